@@ -0,0 +1,228 @@
+# Imports
+import contextlib
+import glob
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from FuseAllTables import process_csv_files
+from LocationTaxonomy import location_filters
+from LogCache import default_cache_path
+from StageMetrics import peak_rss_bytes
+from SyntheticLogs import generate_log
+
+# The pipeline being measured, its stage functions are imported from the script itself
+PIPELINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CombinedCode(speedy).py")
+
+# Stages in the order they run, every report has all of them so reports of different runs line up
+BENCHMARK_STAGES = ['parse_logs', 'create_csv', 'partition', 'fuse', 'analyze_trips', 'process_csv_files']
+
+REPORT_VERSION = 1
+
+
+# Functions
+
+def load_pipeline(script_path=PIPELINE_SCRIPT):
+    # The script's name is not a valid module name, so it is loaded from its path
+    spec = importlib.util.spec_from_file_location('combined_code_speedy', script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(stages, name, func, *args):
+    # Run one stage and record its wall time, the process peak RSS after it and, when tracing, its own peak allocation
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        result = func(*args)
+    stages[name] = {
+        'seconds': round(time.perf_counter() - start, 4),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_traced_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+    }
+    return result
+
+
+def run_scale(log_file_path, output_folder, duration_threshold=120, parse_workers=1, trace_memory=False):
+    # Time every stage of the pipeline on one log, runs in its own process so the peak RSS belongs to this scale
+    # Every stage writes its CSVs as the script does with write_intermediate_csvs set
+    pipeline = load_pipeline()
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+
+    # Always a cold parse, a cache left by an earlier run would time a file read instead
+    cache_file = default_cache_path(log_file_path)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+    if trace_memory:
+        tracemalloc.start()
+    stages = {}
+    start = time.perf_counter()
+
+    log_entries = timed(stages, 'parse_logs', pipeline.parse_logs,
+                        log_file_path, None, duration_threshold, location_filters, parse_workers)
+
+    def create_tables():
+        return (pipeline.create_csv(log_entries, os.path.join(output_folder, "formatted_log_data.csv"), duration_threshold),
+                pipeline.create_grouped_csv(log_entries, os.path.join(output_folder, "grouped_Log_data.csv"), duration_threshold))
+    table, grouped_table = timed(stages, 'create_csv', create_tables)
+
+    group_tables = timed(stages, 'partition', pipeline.process_grouped_locations_to_separate_files,
+                         table, output_folder, location_filters)
+
+    # Fuse and analyze every group table and the full and grouped tables, as the pipeline does
+    inputs = {os.path.splitext(os.path.basename(path))[0]: group_table for path, group_table in group_tables.items()}
+    inputs['FullTrips'] = table
+    inputs['GroupedTrips'] = grouped_table
+
+    def fuse_tables():
+        return {key: pipeline.remove_invalid_locations_and_fuse(value, os.path.join(output_folder, f"fused_{key}.csv"))
+                for key, value in inputs.items()}
+    fused = timed(stages, 'fuse', fuse_tables)
+
+    def analyze_tables():
+        for key, value in fused.items():
+            pipeline.analyze_trips(value, *[os.path.join(output_folder, f"{name}_{key}.csv") for name in
+                                            ['individual_order_trips_with_times', 'individual_unique_trips_with_time',
+                                             'grouped_order_trips_with_times', 'grouped_unique_trips_with_times']])
+    timed(stages, 'analyze_trips', analyze_tables)
+
+    # FuseAllTables reads a folder of grouped unique trip tables, gathered as findall.py does
+    grouped_data = os.path.join(output_folder, "groupedData")
+    os.makedirs(grouped_data)
+    for path in glob.glob(os.path.join(output_folder, "grouped_unique_trips_with_times_*.csv")):
+        shutil.copy(path, grouped_data)
+    timed(stages, 'process_csv_files', process_csv_files, grouped_data, os.path.join(output_folder, "name.csv"))
+
+    total = time.perf_counter() - start
+    if trace_memory:
+        tracemalloc.stop()
+
+    return {
+        'log_bytes': os.path.getsize(log_file_path),
+        'trackers': int(log_entries['id'].nunique()),
+        'visits': len(log_entries),
+        'stages': stages,
+        'total_seconds': round(total, 4),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def print_report(report, baseline=None):
+    # Seconds per stage and scale, with the ratio to the same stage and scale of a baseline report
+    baseline_scales = {scale['n_trackers']: scale for scale in (baseline or {}).get('scales', [])}
+    print(f"{'Trackers':>10} {'Stage':<20} {'Seconds':>10} {'Baseline':>10} {'Ratio':>8}")
+    for scale in report['scales']:
+        before = baseline_scales.get(scale['n_trackers'], {}).get('stages', {})
+        for name in BENCHMARK_STAGES + ['total']:
+            seconds = scale['total_seconds'] if name == 'total' else scale['stages'][name]['seconds']
+            previous = before.get(name, {}).get('seconds') if name != 'total' else \
+                baseline_scales.get(scale['n_trackers'], {}).get('total_seconds')
+            ratio = f"{seconds / previous:8.2f}" if previous else f"{'':>8}"
+            previous = f"{previous:10.3f}" if previous is not None else f"{'':>10}"
+            print(f"{scale['n_trackers']:>10} {name:<20} {seconds:10.3f} {previous} {ratio}")
+        if scale['peak_rss_bytes'] is not None:
+            print(f"{scale['n_trackers']:>10} {'peak RSS (MB)':<20} {scale['peak_rss_bytes'] / 2 ** 20:10.1f}")
+
+
+def run_benchmark(scales, work_folder, report_file, seed=0, duration_threshold=120, parse_workers=1,
+                  trace_memory=False, keep_outputs=False):
+    # Generate a synthetic log per scale (kept in work_folder and reused by later runs) and time the pipeline on it
+    # The report is rewritten after every scale so a long run that is stopped keeps the scales it finished
+    os.makedirs(work_folder, exist_ok=True)
+    report = {
+        'version': REPORT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'seed': seed,
+        'duration_threshold': duration_threshold,
+        'parse_workers': parse_workers,
+        'trace_memory': trace_memory,
+        'stages': BENCHMARK_STAGES,
+        'scales': [],
+    }
+
+    # A fresh interpreter per scale, a forked one would start with the parent's memory
+    context = multiprocessing.get_context('spawn')
+    for n_trackers in scales:
+        log_file_path = os.path.join(work_folder, f"synthetic_{n_trackers}_seed{seed}.txt")
+        generate_seconds = None
+        if not os.path.exists(log_file_path):
+            print(f"Generating {n_trackers} trackers: {log_file_path}")
+            start = time.perf_counter()
+            generate_log(log_file_path, n_trackers, seed)
+            generate_seconds = round(time.perf_counter() - start, 4)
+
+        print(f"Benchmarking {n_trackers} trackers")
+        output_folder = os.path.join(work_folder, f"output_{n_trackers}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_scale, log_file_path, output_folder, duration_threshold,
+                                     parse_workers, trace_memory).result()
+        if not keep_outputs:
+            shutil.rmtree(output_folder, ignore_errors=True)
+
+        report['scales'].append({'n_trackers': n_trackers, 'generate_seconds': generate_seconds, **result})
+        temp_file = report_file + '.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(report, file, indent=1)
+        os.replace(temp_file, report_file)
+
+    print(f"Benchmark report saved to: {report_file}")
+    return report
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Number of trackers per run, a million trackers makes a log of about 7.5 GB
+    scales = [1000, 10000, 100000]
+
+    # Generated logs and outputs go here, logs are reused by later runs with the same scale and seed
+    work_folder = os.path.join(os.getcwd(), "benchmark_runs")
+
+    # Report of this run, and an earlier report to compare with (None for no comparison)
+    report_file = os.path.join(work_folder, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    baseline_report_file = None
+
+    # Same seed, same logs
+    seed = 0
+
+    # Minimum visit duration in seconds, as in the pipeline
+    duration_threshold = 120
+
+    # Processes used to parse the log, 1 times the serial parser
+    parse_workers = 1
+
+    # Set to True to also record each stage's own peak allocation with tracemalloc, this slows the stages down
+    trace_memory = False
+
+    report = run_benchmark(scales, work_folder, report_file, seed, duration_threshold, parse_workers, trace_memory)
+
+    baseline = None
+    if baseline_report_file is not None:
+        with open(baseline_report_file, 'r') as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
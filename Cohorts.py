@@ -0,0 +1,89 @@
+# Imports
+import json
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# One group of trackers analyzed together, its outputs go to "<name><threshold>" folders (e.g. ApgarOnly2min)
+# ids: frozenset of tracker ids, None for every tracker in the log
+# excluded: frozenset of ids always left out (bad trackers)
+Cohort = namedtuple('Cohort', ['name', 'ids', 'excluded'])
+
+# Cohort membership is kept as bits of one int64 column
+MAX_COHORTS = 63
+
+# Ids in a file may be separated by newlines, commas, semicolons or spaces, quotes and brackets are ignored
+# so a pasted Python list works as well
+ID_SEPARATORS = re.compile(r"[\s,;'\"\[\]]+")
+
+
+# Functions
+
+def read_id_file(path):
+    # Tracker ids listed in a text file, '#' starts a comment
+    ids = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split('#', 1)[0]
+            ids.extend(token for token in ID_SEPARATORS.split(line) if token)
+    return ids
+
+
+def compile_ids(value, folder):
+    # A file name (relative to folder) or a list of ids to a frozenset, None stays None
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = read_id_file(os.path.join(folder, value))
+    return frozenset(map(str, value))
+
+
+def load_cohorts(path):
+    # Cohort definitions from a JSON file, in file order:
+    # {"ApgarOnly": {"ids": "ApgarOnly_ids.txt", "exclude": "bad_ids.txt"}, "AllID": {"ids": null, "exclude": "bad_ids.txt"}}
+    # "ids" and "exclude" are id files next to the JSON file or lists of ids, null (or no) "ids" takes every tracker
+    folder = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as file:
+        definitions = json.load(file)
+
+    cohorts = []
+    for name, definition in definitions.items():
+        excluded = compile_ids(definition.get('exclude'), folder)
+        cohorts.append(Cohort(name, compile_ids(definition.get('ids'), folder), excluded or frozenset()))
+
+    if len(cohorts) > MAX_COHORTS:
+        raise ValueError(f"At most {MAX_COHORTS} cohorts can be run together, got {len(cohorts)}")
+    return cohorts
+
+
+def selected_ids(cohorts):
+    # Every tracker some cohort needs, None when a cohort takes every tracker
+    selected = set()
+    for cohort in cohorts:
+        if cohort.ids is None:
+            return None
+        selected |= cohort.ids - cohort.excluded
+    return selected
+
+
+def tag_cohorts(log_entries, cohorts):
+    # Adds a cohorts column, bit i is set when the entry's tracker belongs to cohorts[i]
+    # Membership is decided once per tracker, not once per entry
+    codes, unique_ids = pd.factorize(log_entries['id'].astype(str))
+    unique_ids = pd.Index(unique_ids)
+    masks = np.zeros(len(unique_ids), dtype=np.int64)
+    for bit, cohort in enumerate(cohorts):
+        member = ~unique_ids.isin(cohort.excluded)
+        if cohort.ids is not None:
+            member &= unique_ids.isin(cohort.ids)
+        masks[member] |= np.int64(1) << bit
+    return log_entries.assign(cohorts=masks[codes] if len(codes) else np.zeros(0, dtype=np.int64))
+
+
+def cohort_entries(log_entries, bit):
+    # The entries of the trackers in cohort number `bit`
+    selected = (log_entries['cohorts'].to_numpy() >> bit) & 1 == 1
+    return log_entries[selected].reset_index(drop=True)
@@ -1,56 +1,85 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
-def process_csv_files(input_folder, output_file):
-    # Create lists to hold file data and names
-    data_frames = []
-    filenames = []
+# Columns the fused table is built from, the list columns of the grouped tables are never read
+COUNT_TABLE_COLUMNS = ('Unique_Locations', 'Count')
+
+def read_count_table(file_path):
+    # Unique_Locations and Count of one grouped unique table, None when it lacks either column
+    df = pd.read_csv(file_path, usecols=lambda column: column in COUNT_TABLE_COLUMNS)
+    if not all(column in df.columns for column in COUNT_TABLE_COLUMNS):
+        return None
+    return df[list(COUNT_TABLE_COLUMNS)]
+
+def read_count_tables(file_paths, max_workers=8):
+    # Count tables of several files read side by side, in the order of file_paths (None for a file without the columns)
+    if len(file_paths) <= 1 or max_workers == 1:
+        return [read_count_table(file_path) for file_path in file_paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_count_table, file_paths))
 
-    # Loop through each CSV file in the specified folder
-    for file in os.listdir(input_folder):
-        if file.endswith('.csv'):
-            file_path = os.path.join(input_folder, file)
-            df = pd.read_csv(file_path)
+def merge_count_tables(names, tables):
+    # The original outer merge chain, only used when a table repeats a Unique_Locations value
+    # (a merge pairs up every repeat, which one pivot cannot reproduce)
+    frames = [table.rename(columns={'Count': f"{name}_count"}) for name, table in zip(names, tables)]
+    combined_df = frames[0]
+    for df in frames[1:]:
+        combined_df = pd.merge(combined_df, df, on='Unique_Locations', how='outer')
+    return combined_df.fillna(0)
 
-            # Ensure that the column names are as expected
-            if 'Unique_Locations' in df.columns and 'Count' in df.columns:
-                # Rename 'Count' column to distinguish between files
-                count_column_name = f"{file}_count"
-                df = df[['Unique_Locations', 'Count']].copy()
-                df.rename(columns={'Count': count_column_name}, inplace=True)
+def fuse_count_tables(names, tables):
+    # One row per Unique_Locations with a {name}_count and a {name}_percent column per table, in the order of names
+    # The tables are stacked in long form (source, Unique_Locations, Count) and spread with one pivot,
+    # giving the same frame as merging them one by one: keys sorted once there is more than one table,
+    # missing counts 0 and a count column only turned float when it has a missing count
+    count_columns = [f"{name}_count" for name in names]
+    if any(table['Unique_Locations'].duplicated().any() for table in tables):
+        combined_df = merge_count_tables(names, tables)
+    elif len(tables) == 1:
+        combined_df = tables[0].rename(columns={'Count': count_columns[0]})
+    else:
+        long_df = pd.concat([table.assign(source=index) for index, table in enumerate(tables)], ignore_index=True)
+        wide = long_df.pivot(index='Unique_Locations', columns='source', values='Count')
+        wide = wide.reindex(columns=range(len(tables)))
+        columns = {'Unique_Locations': wide.index.to_numpy()}
+        for index, (column, table) in enumerate(zip(count_columns, tables)):
+            counts = wide[index].to_numpy()
+            # A table holding every key keeps its own dtype, as an outer merge leaves it
+            if len(table) == len(wide):
+                counts = counts.astype(table['Count'].dtype)
+            columns[column] = counts
+        combined_df = pd.DataFrame(columns).fillna(0)
 
-                # Add filename to the list for later use
-                filenames.append(file)
+    # Add percentage columns, built together so hundreds of tables do not insert them one by one
+    percents = {f"{name}_percent": (combined_df[column] / combined_df[column].sum()) * 100
+                for name, column in zip(names, count_columns)}
+    return pd.concat([combined_df, pd.DataFrame(percents, index=combined_df.index)], axis=1)
 
-                # Append the dataframe
-                data_frames.append(df)
+def process_csv_files(input_folder, output_file, max_workers=8):
+    # Every CSV file in the folder with Unique_Locations and Count columns, in directory listing order
+    files = [file for file in os.listdir(input_folder) if file.endswith('.csv')]
+    tables = read_count_tables([os.path.join(input_folder, file) for file in files], max_workers)
+    filenames = [file for file, table in zip(files, tables) if table is not None]
+    tables = [table for table in tables if table is not None]
 
-    # Merge all dataframes on 'Unique_Locations'
-    if not data_frames:
+    if not tables:
         print("No CSV files found with the required columns.")
         return
-    
-    combined_df = data_frames[0]
-    for df in data_frames[1:]:
-        combined_df = pd.merge(combined_df, df, on='Unique_Locations', how='outer')
-
-    # Replace NaN values with 0 for counts
-    combined_df.fillna(0, inplace=True)
 
-    # Add percentage columns
-    for file in filenames:
-        count_column = f"{file}_count"
-        percent_column = f"{file}_percent"
-        combined_df[percent_column] = (combined_df[count_column] / combined_df[count_column].sum()) * 100
+    combined_df = fuse_count_tables(filenames, tables)
 
     # Save the resulting dataframe to a new CSV file
     combined_df.to_csv(output_file, index=False)
 
     print(f"Processed file saved to: {output_file}")
 
-# Specify the input folder and output file path
-input_folder = r"C:\Users\danie\Documents\scripts\finalCode\groupedData"  # Update with the path to your folder
-output_file = r"C:\Users\danie\Documents\scripts\finalCode\name.csv"  # Update with the desired output file path
+# Main Execution
+if __name__ == "__main__":
+    # Specify the input folder and output file path
+    input_folder = r"C:\Users\danie\Documents\scripts\finalCode\groupedData"  # Update with the path to your folder
+    output_file = r"C:\Users\danie\Documents\scripts\finalCode\name.csv"  # Update with the desired output file path
 
-# Run the function
-process_csv_files(input_folder, output_file)
+    # Run the function
+    process_csv_files(input_folder, output_file)
@@ -0,0 +1,118 @@
+# Imports
+import os
+import pickle
+
+import pandas as pd
+
+from FuseAllTables import fuse_count_tables, read_count_tables
+
+# The table every run folder holds, in its output folder or directly in it
+GROUPED_FILE_NAME = 'grouped_unique_trips_with_timesGroupedTrips.csv'
+
+# Kept next to the fused table, holds the size and mtime and the count table of every source read so far
+HARVEST_STATE_SUFFIX = '.harvest.pkl'
+
+# Bump when the stored state changes shape so old state files are ignored
+HARVEST_STATE_VERSION = 1
+
+
+# Functions
+
+def find_result_files(source_root, file_name=GROUPED_FILE_NAME):
+    # [(name, path)] of the result file of every subfolder of source_root, as findall.py finds them:
+    # subfolder/output/file_name first, then subfolder/file_name; name is the file name findall.py copies it to
+    results = []
+    for subfolder in os.listdir(source_root):
+        subfolder_path = os.path.join(source_root, subfolder)
+        if not os.path.isdir(subfolder_path):
+            continue
+        for target_file in [os.path.join(subfolder_path, 'output', file_name), os.path.join(subfolder_path, file_name)]:
+            if os.path.exists(target_file):
+                results.append((f"{subfolder}_{file_name}", target_file))
+                break
+    return results
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_harvest_state(state_file):
+    # The state holds pickled pandas frames, which another pandas version may fail to load in any number of ways
+    # (AttributeError, ImportError, TypeError...), so any failure just means every source is read again
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'rb') as file:
+                state = pickle.load(file)
+            if isinstance(state, dict) and state.get('version') == HARVEST_STATE_VERSION and \
+                    isinstance(state.get('sources'), dict) and 'output' in state:
+                return state
+        except Exception as error:
+            print(f"Ignoring unreadable harvest state {state_file}: {error}")
+    return {'version': HARVEST_STATE_VERSION, 'sources': {}, 'output': None}
+
+
+def save_harvest_state(state_file, state):
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'wb') as file:
+        pickle.dump(state, file, protocol=4)
+    os.replace(temp_file, state_file)
+
+
+def harvest_tables(source_root, output_file, file_name=GROUPED_FILE_NAME, max_workers=8, force=False):
+    # findall.py and FuseAllTables.process_csv_files in one step: the result file of every run folder under source_root
+    # is read in place by a thread pool and fused into the count/percent table, without copying it into groupedData
+    # Sources whose size and mtime match the last run are not read again, their count tables come from the state file,
+    # and the fused table is only rewritten when a source was added, removed or changed (or force is set)
+    # Columns follow the order the run folders are listed in; returns the fused frame (read back from output_file when
+    # nothing changed), None when nothing was found
+    state_file = output_file + HARVEST_STATE_SUFFIX
+    state = load_harvest_state(state_file)
+    sources = find_result_files(source_root, file_name)
+
+    stamps = {path: file_stamp(path) for _, path in sources}
+    cached = state['sources']
+    changed = [path for _, path in sources if force or path not in cached or cached[path]['stamp'] != stamps[path]]
+    for path, table in zip(changed, read_count_tables(changed, max_workers)):
+        cached[path] = {'stamp': stamps[path], 'table': table}
+    removed = [path for path in cached if path not in stamps]
+    for path in removed:
+        del cached[path]
+
+    names = [name for name, path in sources if cached[path]['table'] is not None]
+    tables = [cached[path]['table'] for _, path in sources if cached[path]['table'] is not None]
+    if not tables:
+        print("No result files found with the required columns.")
+        return None
+
+    # Nothing to fuse when no source changed and the fused table is still the one written last time
+    up_to_date = (not changed and not removed and state['output'] is not None and state['output']['names'] == names
+                  and os.path.exists(output_file) and file_stamp(output_file) == state['output']['stamp'])
+    if up_to_date:
+        print(f"All {len(sources)} result files unchanged, {output_file} is up to date")
+        return pd.read_csv(output_file, float_precision='round_trip')
+
+    combined_df = fuse_count_tables(names, tables)
+    combined_df.to_csv(output_file, index=False)
+    state['output'] = {'names': names, 'stamp': file_stamp(output_file)}
+    print(f"Read {len(changed)} of {len(sources)} result files, fused table saved to: {output_file}")
+    save_harvest_state(state_file, state)
+    return combined_df
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Folder of run folders, each holding grouped_unique_trips_with_timesGroupedTrips.csv directly or in its output folder
+    source_root = r"C:\Users\danie\Documents\scripts\finalCode\2minTables"  # Tables folder path
+
+    # Fused count/percent table, the harvest state is kept next to it
+    output_file = r"C:\Users\danie\Documents\scripts\finalCode\name.csv"  # Update with the desired output file path
+
+    # Threads reading the result files
+    max_workers = 8
+
+    # Set to True to read every result file even when it is unchanged
+    force = False
+
+    harvest_tables(source_root, output_file, max_workers=max_workers, force=force)
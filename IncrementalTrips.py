@@ -0,0 +1,150 @@
+# Imports
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+from LogCache import load_parsed_log, selection_digest
+from LocationTaxonomy import location_filters, compile_taxonomy, map_locations
+from TripAnalysis import summarize_trips, merge_trip_summaries
+from TypedTables import save_typed_frame, typed_path
+from VisitTable import fuse_visits, partition_visits, visits_from_events
+
+# Kept in the output folder, holds the per tracker trip rows of every analyzed table, their trackers per trip order and
+# unique set, and how many parsed visits they cover
+TRIP_STATE_NAME = '.trip_state.pkl'
+
+# Bump when the stored state changes shape so old state files are rebuilt
+TRIP_STATE_VERSION = 2
+
+# Parsed visits at each end of the summarized part that are hashed to check it is still the start of the log
+CHECK_ROWS = 1000
+
+
+# Functions
+
+def settings_digest(duration_threshold, location_filters, target_ids):
+    # Everything besides the log that the stored trip rows depend on
+    text = json.dumps([TRIP_STATE_VERSION, duration_threshold, location_filters, selection_digest(target_ids)])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def events_check(events, n_events):
+    # Hash of the first and last CHECK_ROWS of the first n_events parsed visits
+    rows = pd.concat([events.iloc[:min(CHECK_ROWS, n_events)], events.iloc[max(n_events - CHECK_ROWS, 0):n_events]])
+    digest = hashlib.sha256(str(n_events).encode('ascii'))
+    digest.update(pd.util.hash_pandas_object(rows[['id', 'location', 'enter', 'exit']], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_trip_state(state_file):
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'rb') as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError) as error:
+            print(f"Ignoring unreadable trip state {state_file}: {error}")
+    return None
+
+
+def save_trip_state(state_file, state):
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'wb') as file:
+        pickle.dump(state, file, protocol=4)
+    os.replace(temp_file, state_file)
+
+
+def trip_tables(events, duration_threshold, location_filters):
+    # The fused tables the pipeline analyzes, built from parsed visits: FullTrips, GroupedTrips and one per group
+    entries = events[events['duration'] >= duration_threshold]
+    entries = entries.assign(id="'" + entries['id'].astype(str))
+    table = visits_from_events(entries)
+    grouped_table = visits_from_events(entries.assign(
+        location=map_locations(entries['location'], compile_taxonomy(location_filters), unknown="Unknown")))
+
+    tables = {group: fuse_visits(group_table) for group, group_table in partition_visits(table, location_filters).items()}
+    tables['FullTrips'] = fuse_visits(table)
+    tables['GroupedTrips'] = fuse_visits(grouped_table)
+    return tables
+
+
+def analysis_files(output_folder, name):
+    # Same file names as the pipeline's analyze stages
+    suffix = name if name in ('FullTrips', 'GroupedTrips') else f'_{name}'
+    return [
+        os.path.join(output_folder, f'individual_order_trips_with_times{suffix}.csv'),
+        os.path.join(output_folder, f'individual_unique_trips_with_time{suffix}.csv'),
+        os.path.join(output_folder, f'grouped_order_trips_with_times{suffix}.csv'),
+        os.path.join(output_folder, f'grouped_unique_trips_with_times{suffix}.csv'),
+    ]
+
+
+def update_trip_summaries(log_file_path, output_folder, duration_threshold=120, location_filters=location_filters,
+                          target_ids=None, workers=1, write_typed=False):
+    # Bring the trip analyses in output_folder up to date with a log that only grows at the end
+    # The log is parsed incrementally (see LogCache.load_parsed_log), only trackers with new visits are fused and
+    # summarized, and their rows are merged into the stored rows of every other tracker; the grouped analyses only
+    # regroup the trip orders and unique sets those trackers leave or join
+    # write_typed also rewrites the typed .npz companion of every updated CSV, as the pipeline's analyze stages do
+    # when write_typed_outputs is set
+    # Returns {table name: the four analysis frames} for the tables that changed
+    os.makedirs(output_folder, exist_ok=True)
+    events = load_parsed_log(log_file_path, workers=workers, target_ids=target_ids, incremental=True)
+
+    state_file = os.path.join(output_folder, TRIP_STATE_NAME)
+    settings = settings_digest(duration_threshold, location_filters, target_ids)
+    state = load_trip_state(state_file)
+    if (state is not None and state.get('settings') == settings and state['n_events'] <= len(events)
+            and state['check'] == events_check(events, state['n_events'])):
+        n_done, summaries = state['n_events'], state['summaries']
+    else:
+        if state is not None:
+            print("Settings or log start changed, summarizing every tracker again")
+        n_done, summaries = 0, {}
+
+    # Every visit of a tracker with new visits, so a tracker that shows up again is summarized as a whole
+    touched = set(events['id'].iloc[n_done:])
+    if not touched:
+        print("No new trackers to summarize")
+        return {}
+    tables = trip_tables(events[events['id'].isin(touched)], duration_threshold, location_filters)
+    replaced_ids = {"'" + str(tracker_id) for tracker_id in touched}
+
+    changed = {}
+    for name in list(tables) + [name for name in summaries if name not in tables]:
+        previous = summaries.get(name)
+        if name not in tables and not previous['frames'][0]['ID'].isin(replaced_ids).any():
+            continue
+        current = summarize_trips(tables[name]) if name in tables else None
+        groups = previous['groups'] if previous is not None else ({}, {})
+        frames = merge_trip_summaries(previous['frames'] if previous is not None else None, current, replaced_ids, groups)
+        summaries[name] = {'frames': frames[:2], 'groups': groups}
+        changed[name] = frames
+        for df, output_file in zip(frames, analysis_files(output_folder, name)):
+            df.to_csv(output_file, index=False)
+            if write_typed:
+                save_typed_frame(df, typed_path(output_file))
+
+    save_trip_state(state_file, {'settings': settings, 'n_events': len(events),
+                                 'check': events_check(events, len(events)), 'summaries': summaries})
+    print(f"Summarized {len(touched)} new or changed trackers, {len(changed)} analyses updated in {output_folder}")
+    return changed
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Log that new days of tracker data are appended to
+    log_file_path = "DoubleFilterLogs.txt"
+
+    # Analyses are kept up to date here, with the same file names as the pipeline's
+    output_folder = os.path.join(os.getcwd(), "IncrementalTrips2min")
+
+    # Minimum visit duration in seconds
+    duration_threshold = 120
+
+    # Trackers to analyze, None for every tracker
+    target_ids = None
+
+    update_trip_summaries(log_file_path, output_folder, duration_threshold, location_filters, target_ids)
@@ -0,0 +1,225 @@
+# Imports
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from TripAnalysis import trip_sequences
+from TypedTables import analysis_list_column
+from VisitTable import load_table
+
+# Every set must fit one unsigned 64-bit mask
+MAX_LOCATIONS = 64
+
+# Visited location sets as bitmasks, location code i is bit i
+# ids: tracker of every set (None when the sets come from a grouped table), names: location name of every code (sorted)
+# masks: uint64 set of every row, weights: trackers the row stands for (1 per tracker, Count for grouped tables)
+LocationSets = namedtuple('LocationSets', ['ids', 'names', 'masks', 'weights'])
+
+# Set bits of every byte value, for numpy versions without bitwise_count
+BYTE_BITS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+# Functions
+
+def location_sets(table):
+    # One set per tracker of a visit table, e.g. the fused group-level table (grouped_Log_dataCleaned.csv)
+    ids, names, rows, location_codes, _ = trip_sequences(table)
+    if len(names) > MAX_LOCATIONS:
+        raise ValueError(f"{len(names)} locations do not fit a {MAX_LOCATIONS} bit mask, use the group-level table")
+
+    # Distinct (tracker, location) pairs, the bits of a tracker are summed into its mask
+    pairs = np.unique(rows.astype(np.int64) * MAX_LOCATIONS + location_codes)
+    pair_rows = pairs // MAX_LOCATIONS
+    bits = np.left_shift(np.uint64(1), (pairs % MAX_LOCATIONS).astype(np.uint64))
+    masks = np.zeros(len(ids), dtype=np.uint64)
+    if len(pairs):
+        starts = np.flatnonzero(np.concatenate([[True], pair_rows[1:] != pair_rows[:-1]]))
+        masks[pair_rows[starts]] = np.add.reduceat(bits, starts)
+    return LocationSets(np.asarray(ids, dtype=object), names, masks, np.ones(len(ids), dtype=np.int64))
+
+
+def location_sets_from_csv(csv_path, count_column='Count'):
+    # Sets of a grouped unique output (or a fused name.csv), each row weighted by its count column
+    # Unique_Locations is read with TypedTables, from the typed companion when there is one
+    df = pd.read_csv(csv_path, usecols=lambda column: column in ('Unique_Locations', count_column))
+    locations, offsets = analysis_list_column(csv_path, 'Unique_Locations', df)
+    codes, uniques = pd.factorize(pd.Series(locations, dtype=object), sort=True)
+    if len(uniques) > MAX_LOCATIONS:
+        raise ValueError(f"{len(uniques)} locations do not fit a {MAX_LOCATIONS} bit mask")
+    rows = np.repeat(np.arange(len(df)), np.diff(offsets))
+    masks = np.zeros(len(df), dtype=np.uint64)
+    np.bitwise_or.at(masks, rows, np.left_shift(np.uint64(1), codes.astype(np.uint64)))
+    weights = df[count_column].fillna(0).to_numpy().astype(np.int64)
+    return LocationSets(None, np.asarray(uniques, dtype=object), masks, weights)
+
+
+def encode_set(sets, locations):
+    # Mask of location names, None when a name is not one of the sets' locations
+    codes = {name: code for code, name in enumerate(sets.names.tolist())}
+    mask = 0
+    for name in locations:
+        if name not in codes:
+            return None
+        mask |= 1 << codes[name]
+    return np.uint64(mask)
+
+
+def decode_set(sets, mask):
+    # Sorted location names of a mask, as in Unique_Locations
+    mask = int(mask)
+    return tuple(name for code, name in enumerate(sets.names.tolist()) if mask >> code & 1)
+
+
+def set_sizes(masks):
+    # Locations in every set
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks).astype(np.int64)
+    return BYTE_BITS[np.ascontiguousarray(masks, dtype=np.uint64).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+
+def contains_all(sets, locations):
+    # Rows whose set holds every one of the locations
+    mask = encode_set(sets, locations)
+    if mask is None:
+        return np.zeros(len(sets.masks), dtype=bool)
+    return sets.masks & mask == mask
+
+
+def contains_any(sets, locations):
+    # Rows whose set holds at least one of the locations, unknown names match nothing
+    known = set(sets.names.tolist())
+    mask = encode_set(sets, [name for name in locations if name in known])
+    return sets.masks & mask != 0
+
+
+def size_between(sets, low, high):
+    # Rows whose set has between low and high locations, both included
+    sizes = set_sizes(sets.masks)
+    return (low <= sizes) & (sizes <= high)
+
+
+def co_visits(sets):
+    # Trackers visiting both locations of every pair, the diagonal holds the trackers visiting each location
+    bits = (sets.masks[:, None] >> np.arange(len(sets.names), dtype=np.uint64) & np.uint64(1)).astype(np.int64)
+    counts = bits.T @ (bits * sets.weights[:, None])
+    return pd.DataFrame(counts, index=sets.names.tolist(), columns=sets.names.tolist())
+
+
+def weighted_masks(sets):
+    # Distinct masks with the summed weight of each, the itemset counts only need these
+    masks, inverse = np.unique(sets.masks, return_inverse=True)
+    return masks, np.bincount(inverse, weights=sets.weights, minlength=len(masks)).astype(np.int64)
+
+
+def mask_support(masks, weights, candidates):
+    # Summed weight of the sets holding each candidate mask
+    candidates = np.asarray(candidates, dtype=np.uint64)
+    held = masks[None, :] & candidates[:, None] == candidates[:, None]
+    return held.astype(np.int64) @ weights
+
+
+def frequent_itemsets(sets, min_support, max_size=None):
+    # Location sets visited together by at least min_support trackers (a float below 1 is a share of them), Apriori:
+    # the candidates of size k join two frequent sets of size k - 1 and are kept only when every subset is frequent
+    # Returns {mask: count}
+    masks, weights = weighted_masks(sets)
+    total = int(weights.sum())
+    threshold = max(int(np.ceil(min_support * total)), 1) if isinstance(min_support, float) and min_support < 1 \
+        else max(int(min_support), 1)
+
+    singles = [1 << code for code in range(len(sets.names))]
+    counts = mask_support(masks, weights, singles) if singles else np.zeros(0, dtype=np.int64)
+    level = {mask: int(count) for mask, count in zip(singles, counts.tolist()) if count >= threshold}
+    itemsets = dict(level)
+    size = 1
+    while level and (max_size is None or size < max_size):
+        frequent = sorted(level)
+        candidates = set()
+        for index, first in enumerate(frequent):
+            for second in frequent[index + 1:]:
+                joined = first | second
+                if bin(joined).count('1') == size + 1 and joined not in candidates and \
+                        all(joined & ~(1 << code) in level for code in range(len(sets.names)) if joined >> code & 1):
+                    candidates.add(joined)
+        if not candidates:
+            break
+        candidates = sorted(candidates)
+        counts = mask_support(masks, weights, candidates)
+        level = {mask: int(count) for mask, count in zip(candidates, counts.tolist()) if count >= threshold}
+        itemsets.update(level)
+        size += 1
+    return itemsets
+
+
+def itemset_frame(sets, itemsets):
+    # Frequent itemsets as a frame, most visited first; Support is the share of all trackers
+    total = max(int(sets.weights.sum()), 1)
+    df = pd.DataFrame({
+        'Locations': pd.Series([decode_set(sets, mask) for mask in itemsets], dtype=object),
+        'Size': np.array([bin(mask).count('1') for mask in itemsets], dtype=np.int64),
+        'Count': np.array(list(itemsets.values()), dtype=np.int64),
+    })
+    df['Support'] = df['Count'] / total
+    df = df.sort_values(['Count', 'Size', 'Locations'], ascending=[False, True, True], kind='stable')
+    return df.reset_index(drop=True)
+
+
+def association_rules(sets, itemsets, min_confidence=0.5):
+    # Rules "visitors to the antecedent also visit the consequent" from frequent itemsets of two or more locations
+    # Confidence: share of the antecedent's trackers that also visit the consequent,
+    # Lift: confidence over the consequent's own support (above 1 when they go together more than by chance)
+    total = max(int(sets.weights.sum()), 1)
+    rules = []
+    for mask, count in itemsets.items():
+        # Every non-empty proper subset as the antecedent, all subsets of a frequent set are frequent too
+        antecedent = (mask - 1) & mask
+        while antecedent:
+            consequent = mask & ~antecedent
+            confidence = count / itemsets[antecedent]
+            if confidence >= min_confidence:
+                rules.append((decode_set(sets, antecedent), decode_set(sets, consequent), count, count / total,
+                              confidence, confidence / (itemsets[consequent] / total)))
+            antecedent = (antecedent - 1) & mask
+    df = pd.DataFrame(rules, columns=['Antecedent', 'Consequent', 'Count', 'Support', 'Confidence', 'Lift'])
+    df = df.sort_values(['Confidence', 'Count', 'Antecedent', 'Consequent'], ascending=[False, False, True, True], kind='stable')
+    return df.reset_index(drop=True)
+
+
+def find_location_rules(source, output_itemsets_file=None, output_rules_file=None, min_support=0.05, min_confidence=0.5,
+                        count_column='Count'):
+    # source: a grouped unique CSV (Unique_Locations with a count column) or a visit table / fused wide CSV
+    # Returns the itemset and rule frames, each written to its file unless that is None
+    if isinstance(source, str) and not os.path.exists(source):
+        print(f"File not found: {source}")
+        return
+    if isinstance(source, str) and 'Unique_Locations' in pd.read_csv(source, nrows=0).columns:
+        sets = location_sets_from_csv(source, count_column)
+    else:
+        sets = location_sets(load_table(source))
+
+    itemsets = frequent_itemsets(sets, min_support)
+    itemsets_df = itemset_frame(sets, itemsets)
+    rules_df = association_rules(sets, itemsets, min_confidence)
+    for df, output_file in [(itemsets_df, output_itemsets_file), (rules_df, output_rules_file)]:
+        if output_file is not None:
+            df.to_csv(output_file, index=False)
+            print(f"{len(df)} rows saved to: {output_file}")
+    return itemsets_df, rules_df
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Visited group sets with their tracker counts, as written by the pipeline
+    input_file = os.path.join(os.getcwd(), "ApgarOnly2min", "grouped_unique_trips_with_timesGroupedTrips.csv")
+    output_itemsets_file = os.path.join(os.getcwd(), "ApgarOnly2min", "frequent_location_sets.csv")
+    output_rules_file = os.path.join(os.getcwd(), "ApgarOnly2min", "location_rules.csv")
+
+    # Share of trackers a set of groups must be visited together by
+    min_support = 0.05
+
+    # Share of the antecedent's visitors that must also visit the consequent
+    min_confidence = 0.5
+
+    find_location_rules(input_file, output_itemsets_file, output_rules_file, min_support, min_confidence)
@@ -0,0 +1,96 @@
+# Imports
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+# Larger Locations and their associated locations
+# This is the one editable copy, every script imports it from here
+location_filters = {
+    "Apgar": ["Apgar_village", "Apgar_campground", "Rocky_point_trail", "Apgar_VC", "Apgar_VC_parking"],
+
+    "Avalanche": ["Avalanche_trail", "Trail_of_Cedars", "Avalanche_parking", "Shuttle_Avalanche"],
+
+    "Logan": ["Logan_pass_VC",  "Hidden_lake_trail", "Loop_highline_grinnell_glac", "Oberlin_climbing",
+              "Logan_pass_parking", "Hidden_lake_overlook", "Shuttle_Logan_pass"],
+
+    "LakeMcDonald": ["Shuttle_Lake_macdonald", "Lake_macdonald_lodge"],
+
+    "Loop": ["Loop_parking","Shuttle_Loop"],
+
+    "Waterfalls": ["Gunsight_trailhead_stMary_falls", "Baring_falls_parking", "St_mary_falls_parking", "StMary_falls_trail",
+                   "Baring_falls_trail", "Baring_falls_to_st_mary_falls", "Baring_falls_to_sun_point",
+                   "Viriginia_falls_trail", "Shuttle_St_mary_falls", "Jackson_glac_overlook", "Shuttle_Jackson_glac_overlook",
+                   "Shuttle_Sunrift_gorge"],
+
+    "SunPoint": ["Sun_point_nature_trail", "Sun_point_parking", "Shuttle_Sun_point"],
+
+    "RisingSun": ["Rising_sun_boat_dock",  "Rising_sun_campground", "Rising_sun_picnic_area", "Rising_sun",
+                  "Shuttle_Rising_Sun", "Otokomi_lake_trail"],
+
+    "StMary": ["St_mary_campground", "St_mary_VC", "St_mary_VC_parking"],
+
+    "Not Sorted": ["Fish_creek", "Moose_country" , "Wild_goose_island", "Oberlin_bend", "Siyeh_bend_trail", "Big_bend",
+            "Lunch_creek", "Siyeh_pass_trail","Red_eagle_trail","Red_rock", "Siyeh_bend_parking",
+            "Lunch_creek_parking", "Shuttle_Siyeh_bend", "Many_glacier_trail"]
+
+}
+
+# Compiled form of a location_filters dict
+# groups: group names in dict order, locations: every location in dict order
+# location_codes: location -> index into locations, group_codes: group index of every location
+Taxonomy = namedtuple('Taxonomy', ['groups', 'locations', 'location_codes', 'group_codes'])
+
+
+# Functions
+
+def validate_location_filters(location_filters):
+    # A location may only be listed once, in exactly one group
+    problems = []
+    seen = {}
+    for group, locations in location_filters.items():
+        for location in locations:
+            if location not in seen:
+                seen[location] = group
+            elif seen[location] == group:
+                problems.append(f"'{location}' is listed twice under '{group}'")
+            else:
+                problems.append(f"'{location}' is listed under both '{seen[location]}' and '{group}'")
+
+    if problems:
+        raise ValueError("Invalid location_filters: " + "; ".join(problems))
+
+
+def compile_taxonomy(location_filters):
+    # Inverted hash index from location to group, checked for duplicates and overlaps first
+    validate_location_filters(location_filters)
+
+    groups = list(location_filters)
+    locations = []
+    group_codes = []
+    for group_code, group_locations in enumerate(location_filters.values()):
+        locations.extend(group_locations)
+        group_codes.extend([group_code] * len(group_locations))
+
+    location_codes = {location: code for code, location in enumerate(locations)}
+    return Taxonomy(groups, locations, location_codes, np.asarray(group_codes, dtype=np.int64))
+
+
+def encode_locations(locations, taxonomy):
+    # Categorical codes of a whole column, -1 for locations in no group
+    return pd.Categorical(locations, categories=taxonomy.locations).codes.astype(np.int64)
+
+
+def group_codes_of(locations, taxonomy):
+    # Group index of every location, -1 for locations in no group
+    codes = encode_locations(locations, taxonomy)
+    return np.append(taxonomy.group_codes, -1).take(codes)
+
+
+def map_locations(locations, taxonomy, unknown=None):
+    # Group name of every location in one take on the code array, unknown for locations in no group
+    names = np.array(taxonomy.groups + [unknown], dtype=object)
+    return names.take(group_codes_of(locations, taxonomy))
+
+
+# Compiled once for the scripts that use location_filters as is
+TAXONOMY = compile_taxonomy(location_filters)
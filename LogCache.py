@@ -0,0 +1,164 @@
+# Imports
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from LogIngest import complete_blocks_end, parse_log_events_parallel
+
+# Bump when parsing changes so old cache files are rebuilt instead of reused
+PARSER_VERSION = 4
+
+# Cache files sit next to the log, e.g. DoubleFilterLogs.txt.visits.npz
+CACHE_SUFFIX = '.visits.npz'
+
+EVENT_COLUMNS = ['id', 'location', 'enter', 'exit', 'duration']
+
+# Bytes at each end of the parsed part of a log that must be unchanged for an incremental cache to be extended
+PREFIX_WINDOW = 1 << 20
+
+
+# Functions
+
+def file_digest(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_cache_path(log_file_path):
+    return log_file_path + CACHE_SUFFIX
+
+
+def prefix_digest(file_path, offset, window=PREFIX_WINDOW):
+    # Hash of the first and the last `window` bytes before offset, enough to tell a log that was only
+    # appended to from one that was rewritten, without reading the whole file
+    digest = hashlib.sha256(str(offset).encode('ascii'))
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(min(window, offset)))
+        file.seek(max(offset - window, 0))
+        digest.update(file.read(min(window, offset)))
+    return digest.hexdigest()
+
+
+def selection_digest(target_ids):
+    # Which trackers a cache holds, 'all' or a hash of the sorted ids
+    if target_ids is None:
+        return 'all'
+    text = '\n'.join(sorted(set(map(str, target_ids))))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def save_events(cache_file, events, size, mtime_ns, digest, selection='all', offset=None, prefix=''):
+    # Strings are stored as codes into small unique arrays so the file stays compact
+    # offset: end of the parsed bytes, the file size unless a trailing block was held back by an incremental parse
+    # prefix: prefix_digest at offset, set by incremental parses so a later run can parse only what was appended
+    id_codes, id_values = pd.factorize(events['id'])
+    location_codes, location_values = pd.factorize(events['location'])
+    # Write to a temporary file first so an interrupted run never leaves a half written cache
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, 'wb') as file:
+        np.savez(
+            file,
+            parser_version=np.int64(PARSER_VERSION),
+            size=np.int64(size),
+            mtime_ns=np.int64(mtime_ns),
+            digest=np.str_(digest),
+            selection=np.str_(selection),
+            offset=np.int64(size if offset is None else offset),
+            prefix=np.str_(prefix),
+            id_codes=id_codes.astype(np.int32),
+            id_values=np.asarray(id_values, dtype=str),
+            location_codes=location_codes.astype(np.int32),
+            location_values=np.asarray(location_values, dtype=str),
+            enter=events['enter'].to_numpy(dtype=np.int64),
+            exit=events['exit'].to_numpy(dtype=np.int64),
+            duration=events['duration'].to_numpy(dtype=np.float64),
+        )
+    os.replace(temp_file, cache_file)
+
+
+def load_events(data):
+    return pd.DataFrame({
+        'id': data['id_values'].astype(object).take(data['id_codes']),
+        'location': data['location_values'].astype(object).take(data['location_codes']),
+        'enter': data['enter'],
+        'exit': data['exit'],
+        'duration': data['duration'],
+    })
+
+
+def select_events(events, target_ids):
+    if target_ids is None:
+        return events
+    return events[events['id'].isin(set(target_ids))].reset_index(drop=True)
+
+
+def load_parsed_log(log_file_path, cache_file=None, use_cache=True, workers=1, target_ids=None, incremental=False):
+    # Parsed event table for the log, read from the cache when the log is unchanged
+    # Size and mtime are checked first, the content hash only when the mtime moved
+    # On a miss the log is parsed by `workers` processes (None for every CPU), see LogIngest
+    # target_ids limits a fresh parse to those trackers' group_id blocks, a cache of every tracker serves any selection
+    # incremental is for logs that only grow at the end: only complete group_id blocks are parsed, a block still being
+    # written is held back, and a later run parses just the blocks after the checkpoint and appends their events
+    if cache_file is None:
+        cache_file = default_cache_path(log_file_path)
+    stat = os.stat(log_file_path)
+    digest = None
+    selection = selection_digest(target_ids)
+
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as data:
+                # Older versions have no selection field, so it is only read once the version matches
+                if int(data['parser_version']) == PARSER_VERSION and str(data['selection']) in ('all', selection):
+                    size = int(data['size'])
+                    offset = int(data['offset'])
+                    held_back = offset < size
+                    if size == stat.st_size and int(data['mtime_ns']) == stat.st_mtime_ns and (incremental or not held_back):
+                        return select_events(load_events(data), target_ids)
+
+                    # Checkpoint of an incremental parse: parse only the blocks completed since, if the parsed part is untouched
+                    if (incremental and str(data['prefix']) and size <= stat.st_size
+                            and str(data['prefix']) == prefix_digest(log_file_path, offset)):
+                        end = complete_blocks_end(log_file_path, offset)
+                        events = load_events(data)
+                        if end > offset:
+                            cached_ids = None if str(data['selection']) == 'all' else target_ids
+                            new_events = parse_log_events_parallel(log_file_path, workers=workers, target_ids=cached_ids,
+                                                                   start=offset, end=end)
+                            events = pd.concat([events, new_events], ignore_index=True)
+                            print(f"Parsed {end - offset} appended bytes, {len(new_events)} new visits")
+                        save_events(cache_file, events, stat.st_size, stat.st_mtime_ns, '', str(data['selection']),
+                                    end, prefix_digest(log_file_path, end))
+                        return select_events(events, target_ids)
+
+                    if size == stat.st_size and not held_back and str(data['digest']):
+                        digest = file_digest(log_file_path)
+                        if str(data['digest']) == digest:
+                            events = load_events(data)
+                            # Same content with a new mtime, record it so the next run skips hashing
+                            save_events(cache_file, events, stat.st_size, stat.st_mtime_ns, digest, str(data['selection']))
+                            return select_events(events, target_ids)
+        except (OSError, KeyError, ValueError) as error:
+            print(f"Ignoring unreadable cache {cache_file}: {error}")
+
+    if incremental:
+        # The whole file is not hashed, the prefix digest at the checkpoint is what later runs check
+        end = complete_blocks_end(log_file_path)
+        events = parse_log_events_parallel(log_file_path, workers=workers, target_ids=target_ids, end=end)
+        if use_cache:
+            save_events(cache_file, events, stat.st_size, stat.st_mtime_ns, '', selection, end, prefix_digest(log_file_path, end))
+            print(f"Parsed log cached to: {cache_file} (checkpoint at byte {end} of {stat.st_size})")
+        return events
+
+    events = parse_log_events_parallel(log_file_path, workers=workers, target_ids=target_ids)
+    if use_cache:
+        if digest is None:
+            digest = file_digest(log_file_path)
+        save_events(cache_file, events, stat.st_size, stat.st_mtime_ns, digest, selection)
+        print(f"Parsed log cached to: {cache_file}")
+    return events
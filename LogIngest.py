@@ -0,0 +1,124 @@
+# Imports
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from LogTokenizer import GROUP_HEADER, NEXT_GROUP_HEADER, scan_log, iter_visits
+
+# Below this size the process start up costs more than it saves, so the serial parser is used
+MIN_PARALLEL_BYTES = 32 * 1024 * 1024
+
+# The last block of a log is complete once its summary is closed by a blank line, earlier blocks once the next header follows
+SUMMARY_HEADER = b'\nSummary for group_id'
+BLANK_LINE_PATTERN = re.compile(rb'\n\r?\n')
+
+
+# Functions
+
+def events_from_visits(visits):
+    # Paired visits (LogTokenizer.Visit) to an event frame with epoch second times
+    ids = []
+    locations = []
+    enter_times = []
+    exit_times = []
+    durations = []
+    for visit in visits:
+        ids.append(visit.id)
+        locations.append(visit.location)
+        enter_times.append(visit.enter_seconds)
+        exit_times.append(visit.exit_seconds)
+        durations.append(visit.duration)
+
+    return pd.DataFrame({
+        'id': pd.Series(ids, dtype=object),
+        'location': pd.Series(locations, dtype=object),
+        'enter': np.asarray(enter_times, dtype=np.int64),
+        'exit': np.asarray(exit_times, dtype=np.int64),
+        'duration': np.asarray(durations, dtype=np.float64),
+    })
+
+
+def parse_log_events(log_file_path, target_ids=None):
+    # Every paired visit of every tracker (or only of target_ids), in log order, with no duration filtering
+    return events_from_visits(iter_visits(scan_log(log_file_path, target_ids=target_ids)))
+
+
+def find_group_offsets(log_file_path):
+    # Byte offset of every "Processing group_id" line, found with bytes.find on the mapped file
+    offsets = []
+    with open(log_file_path, 'rb') as file:
+        if file.seek(0, 2) == 0:
+            return offsets
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:len(GROUP_HEADER)] == GROUP_HEADER:
+                offsets.append(0)
+            index = buffer.find(NEXT_GROUP_HEADER)
+            while index >= 0:
+                offsets.append(index + 1)
+                index = buffer.find(NEXT_GROUP_HEADER, index + 1)
+    return offsets
+
+
+def complete_blocks_end(log_file_path, start=0):
+    # Byte offset where the complete group_id blocks after start end, a trailing block still being written is left out
+    # start is a header or the end of an earlier complete block, start itself when nothing after it is complete
+    with open(log_file_path, 'rb') as file:
+        if file.seek(0, 2) <= start:
+            return start
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            last = buffer.rfind(NEXT_GROUP_HEADER, start) + 1
+            if last == 0:
+                if buffer[start:start + len(GROUP_HEADER)] != GROUP_HEADER:
+                    return start
+                last = start
+            summary = buffer.find(SUMMARY_HEADER, last)
+            blank = BLANK_LINE_PATTERN.search(buffer, summary + 1) if summary >= 0 else None
+            return blank.end() if blank is not None else last
+
+
+def plan_shards(offsets, file_size, n_shards, start=0):
+    # Split [start, file_size) into at most n_shards byte ranges of roughly equal size, cut only at group headers
+    offsets = [offset for offset in offsets if start < offset < file_size]
+    if n_shards <= 1 or not offsets:
+        return [(start, file_size)]
+
+    cuts = [start]
+    target = (file_size - start) / n_shards
+    for offset in offsets:
+        if offset >= start + target * len(cuts):
+            cuts.append(offset)
+        if len(cuts) == n_shards:
+            break
+    cuts.append(file_size)
+    return [(begin, end) for begin, end in zip(cuts[:-1], cuts[1:]) if end > begin]
+
+
+def parse_shard(log_file_path, start, end, target_ids=None):
+    # Parse one byte range that starts at a group header, runs in a worker process
+    return events_from_visits(iter_visits(scan_log(log_file_path, start, end, target_ids)))
+
+
+def parse_log_events_parallel(log_file_path, workers=None, min_parallel_bytes=MIN_PARALLEL_BYTES, target_ids=None,
+                              start=0, end=None):
+    # Shard the log at group_id blocks and parse the shards in a process pool, results keep log order
+    # Small files and workers=1 take the serial path, both give the same event frame
+    # start/end limit the parse to a byte range that starts at a group header (or a block end) and ends at one
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if end is None:
+        end = os.path.getsize(log_file_path)
+    if workers <= 1 or end - start < min_parallel_bytes:
+        return parse_shard(log_file_path, start, end, target_ids)
+
+    shards = plan_shards(find_group_offsets(log_file_path), end, workers, start)
+    if len(shards) == 1:
+        return parse_shard(log_file_path, start, end, target_ids)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        futures = [executor.submit(parse_shard, log_file_path, start, end, target_ids) for start, end in shards]
+        frames = [future.result() for future in futures]
+    return pd.concat(frames, ignore_index=True)
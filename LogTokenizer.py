@@ -0,0 +1,176 @@
+# Imports
+import mmap
+import re
+from collections import namedtuple
+from datetime import date
+
+# Kinds of log lines the tokenizer emits
+GROUP = 'group'
+ENTERED = 'entered'
+EXITED = 'exited'
+WAS_IN = 'was_in'
+SUMMARY = 'summary'
+
+# One event per classified log line
+# tracker_id is the id from the current "Processing group_id" header, location/time are only set for polygon lines
+LogEvent = namedtuple('LogEvent', ['kind', 'tracker_id', 'location', 'time', 'seconds', 'clip'])
+
+# One paired entered/exited visit
+Visit = namedtuple('Visit', ['id', 'location', 'enter_time', 'exit_time', 'enter_seconds', 'exit_seconds', 'duration'])
+
+# Precompiled patterns for the tracker lines
+# "Tracker 12521 entered polygon 'St_mary_VC_parking' at 2023-07-21 08:08:19 (POI)"
+POLYGON_PATTERN = re.compile(r"Tracker \d+ (entered|exited) polygon '(.*?)' at (.*?) \(")
+# "Tracker 12521 was in 'St_mary_VC_parking' for ... (765.0 seconds) (POI)"
+WAS_IN_PATTERN = re.compile(r"Tracker \d+ was in '(.*?)' for .*?\(([\d.]+) seconds\)")
+ID_PATTERN = re.compile(r'\d+')
+
+# Byte level patterns for the mmap scanner, only the lines iter_visits needs (group headers and entered/exited)
+# Log lines end in \n or \r\n, so a line starts at the beginning of the buffer or right after a \n
+# The header id is the first digit run on the line, the same as ID_PATTERN.search
+EVENT_LINE_PATTERN = re.compile(
+    rb"^(?:Processing group_id[^\d\r\n]*(\d+)?"
+    rb"|Tracker \d+ (entered|exited) polygon '([^\r\n]*?)' at ([^\r\n]*?) \()",
+    re.M)
+
+# Every group_id block starts with a header line, blocks of unselected trackers are skipped by searching for the next one
+GROUP_HEADER = b'Processing group_id'
+NEXT_GROUP_HEADER = b'\n' + GROUP_HEADER
+HEADER_PATTERN = re.compile(rb"Processing group_id[^\d\r\n]*(\d+)?")
+
+# Logs are read as UTF-8 text, undecodable bytes never stop a parse
+LOG_ENCODING = 'utf-8'
+
+# Seconds since 1970-01-01 for every calendar day seen so far
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+day_seconds_cache = {}
+
+
+# Functions
+
+def parse_timestamp(text):
+    # Fixed width 'YYYY-MM-DD HH:MM:SS' to integer seconds since the epoch
+    day = text[:10]
+    day_seconds = day_seconds_cache.get(day)
+    if day_seconds is None:
+        day_seconds = (date(int(text[0:4]), int(text[5:7]), int(text[8:10])).toordinal() - EPOCH_ORDINAL) * 86400
+        day_seconds_cache[day] = day_seconds
+    return day_seconds + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+
+
+def tokenize_lines(lines):
+    current_id = None
+
+    for line in lines:
+        # Tracker lines are the bulk of the file, so check them first
+        if line.startswith('Tracker '):
+            if 'polygon' in line:
+                match = POLYGON_PATTERN.match(line)
+                if match:
+                    kind = ENTERED if match.group(1) == 'entered' else EXITED
+                    time = match.group(3)
+                    yield LogEvent(kind, current_id, match.group(2), time, parse_timestamp(time), False)
+            elif ' was in ' in line:
+                match = WAS_IN_PATTERN.match(line)
+                if match:
+                    yield LogEvent(WAS_IN, current_id, match.group(1), None, float(match.group(2)), '(CLIP)' in line)
+            # "Tracker N started at" and "Tracker reached the end of data" carry nothing we use
+
+        elif line.startswith('Processing group_id'):
+            id_match = ID_PATTERN.search(line)
+            current_id = id_match.group() if id_match else None
+            yield LogEvent(GROUP, current_id, None, None, None, False)
+
+        elif line.startswith('Summary for group_id'):
+            yield LogEvent(SUMMARY, current_id, None, None, None, False)
+
+
+def tokenize_log(log_file_path):
+    with open(log_file_path, 'r', encoding=LOG_ENCODING, errors='replace') as file:
+        yield from tokenize_lines(file)
+
+
+def iter_visits(events, target_ids=None):
+    # Pair every exit with the latest entry of the current tracker, the same way parse_logs always has
+    # target_ids is compiled to a set once, so the per line check is a hash lookup
+    # An exit never pairs with an entry from an earlier group_id block, so blocks can be parsed independently
+    current_id = None
+    location = None
+    enter_time = None
+    enter_seconds = None
+    if target_ids is not None:
+        target_ids = set(target_ids)
+
+    for event in events:
+        kind = event.kind
+        if kind == GROUP:
+            current_id = event.tracker_id
+            location = None
+            enter_time = None
+            enter_seconds = None
+            continue
+
+        # Only process if the current ID is in the target list
+        if target_ids is not None and current_id and current_id not in target_ids:
+            continue
+
+        if kind == ENTERED:
+            location = event.location
+            enter_time = event.time
+            enter_seconds = event.seconds
+        elif kind == EXITED:
+            if current_id and location and enter_time:
+                duration = float(event.seconds - enter_seconds)
+                yield Visit(current_id, location, enter_time, event.time, enter_seconds, event.seconds, duration)
+
+
+def scan_events(buffer, start=0, end=None, target_ids=None):
+    # Same GROUP/ENTERED/EXITED events as tokenize_lines, found with one bytes regex over a buffer (bytes or mmap)
+    # Only the captured id, polygon name and timestamp are decoded, the rest of the line is never turned into text
+    # start must be at the beginning of a line
+    # With target_ids only the blocks of those trackers are scanned, the others are jumped over header to header
+    if end is None:
+        end = len(buffer)
+    if target_ids is not None:
+        yield from scan_selected_blocks(buffer, start, end, set(target_ids))
+        return
+    current_id = None
+
+    for match in EVENT_LINE_PATTERN.finditer(buffer, start, end):
+        kind = match.group(2)
+        if kind is None:
+            id_bytes = match.group(1)
+            current_id = id_bytes.decode('ascii') if id_bytes else None
+            yield LogEvent(GROUP, current_id, None, None, None, False)
+        else:
+            time = match.group(4).decode(LOG_ENCODING, errors='replace')
+            yield LogEvent(ENTERED if kind == b'entered' else EXITED, current_id,
+                           match.group(3).decode(LOG_ENCODING, errors='replace'), time, parse_timestamp(time), False)
+
+
+def scan_selected_blocks(buffer, start, end, target_ids):
+    # Only the header line of an unselected block is looked at, its event lines never reach the regex
+    # Lines before the first header belong to no tracker and never pair into visits, so they are skipped too
+    if buffer[start:start + len(GROUP_HEADER)] == GROUP_HEADER:
+        header = start
+    else:
+        header = buffer.find(NEXT_GROUP_HEADER, start, end)
+        header = header + 1 if header >= 0 else -1
+
+    while header >= 0:
+        following = buffer.find(NEXT_GROUP_HEADER, header, end)
+        block_end = following + 1 if following >= 0 else end
+        id_bytes = HEADER_PATTERN.match(buffer, header, block_end).group(1)
+        if id_bytes and id_bytes.decode('ascii') in target_ids:
+            yield from scan_events(buffer, header, block_end)
+        header = following + 1 if following >= 0 else -1
+
+
+def scan_log(log_file_path, start=0, end=None, target_ids=None):
+    # Memory mapped scan of a log file, the file is never read into memory as a whole
+    with open(log_file_path, 'rb') as file:
+        # mmap cannot map an empty file
+        if file.seek(0, 2) == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from scan_events(buffer, start, end, target_ids)
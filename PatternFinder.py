@@ -1,17 +1,23 @@
+import numpy as np
 import pandas as pd
 
+from TypedTables import parse_list_cells
+
 def add_custom_column_with_range(file_path, output_path, new_column_name, num_locations_range, specific_location):
     # Load the CSV file
     df = pd.read_csv(file_path)
 
-    # Function to check if Unique_Locations has the specific number of locations within the range and contains the specific location
-    def check_conditions(row):
-        # Convert the string to a tuple
-        locations = eval(row['Unique_Locations'])
-        return num_locations_range[0] <= len(locations) <= num_locations_range[1] and specific_location in locations
+    # Unique_Locations as one flat array of names with row offsets, parsed from the CSV text (never eval'd)
+    locations, offsets = parse_list_cells(df['Unique_Locations'])
+
+    # Check if Unique_Locations has the specific number of locations within the range and contains the specific location
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(len(df)), counts)
+    contains = np.zeros(len(df), dtype=bool)
+    contains[rows[locations == specific_location]] = True
 
     # Add the new column based on the conditions
-    df[new_column_name] = df.apply(check_conditions, axis=1)
+    df[new_column_name] = (num_locations_range[0] <= counts) & (counts <= num_locations_range[1]) & contains
 
     # Reorder columns to make the new column the first one
     columns = [new_column_name] + [col for col in df.columns if col != new_column_name]
@@ -23,12 +29,13 @@ def add_custom_column_with_range(file_path, output_path, new_column_name, num_lo
     print(f"New column '{new_column_name}' added and file saved to {output_path}.")
 
 
-# Example usage:
-file_path = 'name_updated(1).csv'
-output_path = 'name_updated(2).csv'
-new_column_name = 'Contains_Apgar_in_3_to_4'
-num_locations_range = (3, 4)  # Specify the range (min, max)
-specific_location = 'Apgar'
-
-add_custom_column_with_range(file_path, output_path, new_column_name, num_locations_range, specific_location)
+# Main Execution
+if __name__ == "__main__":
+    # Example usage:
+    file_path = 'name_updated(1).csv'
+    output_path = 'name_updated(2).csv'
+    new_column_name = 'Contains_Apgar_in_3_to_4'
+    num_locations_range = (3, 4)  # Specify the range (min, max)
+    specific_location = 'Apgar'
 
+    add_custom_column_with_range(file_path, output_path, new_column_name, num_locations_range, specific_location)
@@ -0,0 +1,460 @@
+# Imports
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import namedtuple
+
+import pandas as pd
+
+from LogCache import file_digest
+from StageMetrics import add_counts, file_size, measure_call, peak_rss_bytes, profile_path, value_counts, written_bytes, write_run_report
+from VisitTable import VisitTable
+
+# One step of a pipeline
+# func is called as func(*args, **options), any arg equal to one of the stage's inputs is replaced
+# by the value an earlier stage returned for it, so tables are handed over in memory instead of re-read from CSV
+# inputs/outputs: artifact keys, the path of the CSV each artifact is exported to (written or not), they link the stages into a DAG
+# func returns the value of its single output, a tuple in the order of outputs (possibly only the first ones), or a dict keyed by output
+# options: keyword arguments that do not change the outputs (e.g. worker counts), left out of the fingerprint
+Stage = namedtuple('Stage', ['name', 'func', 'args', 'inputs', 'outputs', 'options'], defaults=[{}])
+
+# Kept in the output folder, records the fingerprint of every stage that ran and the artifacts it produced
+STATE_FILE_NAME = '.pipeline_state.json'
+
+# Bump when a change the fingerprints cannot see (e.g. data files read by the stages) must rerun every stage
+PIPELINE_VERSION = 1
+
+# Modules in this folder are project code, their sources are part of the fingerprint of every stage using them
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Plan actions
+RUN = 'run'
+SKIP = 'skip'
+PENDING = 'run if inputs change'
+
+
+# Functions
+
+def stage_producers(stages):
+    # Output key -> name of the stage that produces it
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"Stages '{producers[output]}' and '{stage.name}' both write {output}")
+            producers[output] = stage.name
+    return producers
+
+
+def order_stages(stages):
+    # Topological order that keeps the declared order wherever the dependencies allow it
+    producers = stage_producers(stages)
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique")
+
+    by_name = {stage.name: stage for stage in stages}
+    depends = {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+    ordered = []
+    done = set()
+    while len(ordered) < len(stages):
+        ready = [name for name in names if name not in done and depends[name] <= done]
+        if not ready:
+            raise ValueError("Stage dependencies form a cycle: " + ", ".join(name for name in names if name not in done))
+        ordered.append(by_name[ready[0]])
+        done.add(ready[0])
+    return ordered
+
+
+def load_state(state_file):
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r') as file:
+                state = json.load(file)
+            if isinstance(state, dict):
+                return {'files': state.get('files', {}), 'stages': state.get('stages', {})}
+        except (OSError, ValueError) as error:
+            print(f"Ignoring unreadable pipeline state {state_file}: {error}")
+    return {'files': {}, 'stages': {}}
+
+
+def save_state(state_file, state):
+    # Written after every stage, through a temporary file, so an interrupted run keeps what finished
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(state, file, indent=1)
+    os.replace(temp_file, state_file)
+
+
+def current_digest(path, state):
+    # Content hash of a file, None when it does not exist
+    # The hash is only recomputed when the size or mtime moved since it was last recorded
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    known = state['files'].get(path)
+    if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+        return known[2]
+    digest = file_digest(path)
+    state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def value_digest(value):
+    # Content hash of an in-memory artifact, visit tables and frames are hashed column by column
+    digest = hashlib.sha256()
+    if isinstance(value, VisitTable):
+        digest.update(json.dumps([list(value.ids), value.width]).encode('utf-8'))
+        value = value.visits
+    if isinstance(value, pd.DataFrame):
+        try:
+            digest.update(json.dumps(list(map(str, value.columns))).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+            return digest.hexdigest()
+        except TypeError:
+            # Columns holding lists or tuples cannot be hashed by pandas
+            pass
+    digest.update(pickle.dumps(value, protocol=4))
+    return digest.hexdigest()
+
+
+def project_module(name):
+    # The imported module of that name when its file is in the project folder, else None
+    module = sys.modules.get(name)
+    path = getattr(module, '__file__', None)
+    if path is not None and os.path.dirname(os.path.abspath(path)) == PROJECT_FOLDER:
+        return module
+    return None
+
+
+def project_dependencies(module):
+    # Project modules a module reaches through its globals (imported modules, functions and classes), directly or not
+    found = {}
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        for value in vars(current).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+            dependency = project_module(name) if isinstance(name, str) else None
+            if dependency is not None and dependency is not module and dependency.__name__ not in found:
+                found[dependency.__name__] = dependency
+                pending.append(dependency)
+    return [found[name] for name in sorted(found)]
+
+
+def source_text(value):
+    try:
+        return inspect.getsource(value)
+    except (OSError, TypeError):
+        return getattr(value, '__module__', '') + '.' + getattr(value, '__qualname__', repr(value))
+
+
+def code_digest(func):
+    # Code a stage's outputs depend on: the functions and classes of the stage function's module (not its
+    # configuration block), the whole source of every project module it uses, and PIPELINE_VERSION
+    # so editing e.g. TripAnalysis.py reruns the stages that summarize trips
+    func = getattr(func, 'func', func)
+    digest = hashlib.sha256(str(PIPELINE_VERSION).encode('ascii'))
+    module = sys.modules.get(getattr(func, '__module__', None))
+    if module is None:
+        digest.update(source_text(func).encode('utf-8'))
+        return digest.hexdigest()
+
+    own = [value for _, value in sorted(vars(module).items())
+           if (inspect.isfunction(value) or inspect.isclass(value)) and value.__module__ == module.__name__]
+    for value in own if func in own else [func] + own:
+        digest.update(source_text(value).encode('utf-8'))
+    for dependency in project_dependencies(module):
+        digest.update(dependency.__name__.encode('utf-8'))
+        with open(dependency.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def json_default(value):
+    # Sets are sorted so their digest does not depend on hash order
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+def args_digest(args):
+    text = json.dumps(args, default=json_default)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def artifact_digest(key, producers, state):
+    # Digest an artifact was produced with, as recorded by its stage, or the file contents for outside inputs
+    producer = state['stages'].get(producers.get(key))
+    if producer is not None and key in producer['outputs']:
+        return producer['outputs'][key][0]
+    return current_digest(key, state)
+
+
+def stage_record(stage, producers, state):
+    # Everything a stage's outputs depend on: its code, its arguments and the contents of its inputs
+    return {
+        'code': code_digest(stage.func),
+        'args': args_digest(stage.args),
+        'inputs': {key: artifact_digest(key, producers, state) for key in stage.inputs},
+    }
+
+
+def stale_reason(stage, record, state):
+    # Why a stage has to run, None when its recorded outputs are still valid
+    previous = state['stages'].get(stage.name)
+    if previous is None:
+        return "never ran"
+    if previous['code'] != record['code']:
+        return "code changed"
+    if previous['args'] != record['args']:
+        return "arguments changed"
+    for key, digest in record['inputs'].items():
+        if previous['inputs'].get(key) != digest:
+            return f"input changed: {key}"
+    for key in stage.outputs:
+        recorded = previous['outputs'].get(key)
+        if recorded is None or current_digest(key, state) != recorded[1]:
+            return f"output missing or modified: {key}"
+    return None
+
+
+def plan_stages(stages, state):
+    # Action and reason for every stage before anything runs
+    # Stages downstream of a stage that runs are pending, they rerun only if that stage changes their inputs
+    producers = stage_producers(stages)
+    plan = []
+    changing = set()
+    for stage in order_stages(stages):
+        upstream = [key for key in stage.inputs if key in changing]
+        reason = stale_reason(stage, stage_record(stage, producers, state), state)
+        if reason is not None:
+            action = RUN
+        elif upstream:
+            action, reason = PENDING, f"after {upstream[0]}"
+        else:
+            action = SKIP
+        if action != SKIP:
+            changing.update(stage.outputs)
+        plan.append((stage, action, reason))
+    return plan
+
+
+def print_plan(plan):
+    print("Pipeline plan:")
+    for stage, action, reason in plan:
+        print(f"  {action:<20} {stage.name}" + (f" ({reason})" if reason else ""))
+
+
+def output_values(outputs, result):
+    # Map what a stage function returned onto its output keys
+    if result is None:
+        return {}
+    if isinstance(result, dict):
+        return {key: value for key, value in result.items() if key in outputs}
+    # A shorter tuple maps onto the first outputs, the rest are files the stage writes on the side
+    if len(outputs) > 1 and isinstance(result, tuple) and len(result) <= len(outputs):
+        return dict(zip(outputs, result))
+    if len(outputs) == 1:
+        return {outputs[0]: result}
+    return {}
+
+
+def run_stage_job(func, args, options, outputs, keep, profile_file=None, trace_memory=False):
+    # Runs one stage, in a worker process when the pipeline runs with several workers
+    # Only the values later stages read (keep) are sent back, the rest only go to their CSVs
+    # Returns them with the stage's metrics, rows and trackers are counted on every value it produced
+    result, metrics = measure_call(func, args, options, profile_file, trace_memory)
+    produced = output_values(outputs, result)
+    metrics['outputs'] = {key: value_counts(value) for key, value in produced.items()}
+    return {key: value for key, value in produced.items() if key in keep}, metrics
+
+
+def print_timings(entries):
+    print("Stage timings:")
+    print(f"  {'wall s':>8} {'cpu s':>8} {'rows out':>10}  stage")
+    for entry in entries:
+        if entry['action'] == 'ran':
+            rows = '' if entry['rows_out'] is None else entry['rows_out']
+            print(f"  {entry['wall_seconds']:8.2f} {entry['cpu_seconds']:8.2f} {rows:>10}  {entry['name']}")
+
+
+def run_stages(stages, state_file, force=False, workers=1, report_file=None, profile_folder=None, trace_memory=False):
+    # Run the stages in dependency order, skipping every stage whose code, arguments and input contents
+    # match the last run and whose outputs are untouched
+    # With workers > 1 every stage whose inputs are ready is sent to a process pool, so independent
+    # stages (e.g. the per group fuse and analyze chains) run side by side
+    # Returns {stage name: seconds} for the stages that ran, in the order they finished
+    # With a report_file every stage's wall and CPU time, rows and trackers in and out, bytes read and written
+    # and peak memory are written there as JSON, also when a stage fails
+    # With a profile_folder each stage that runs dumps its cProfile stats there as <stage name>.prof
+    # trace_memory adds each stage's own peak allocation from tracemalloc, at some cost in speed
+    started = datetime.now()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    state = load_state(state_file)
+    if force:
+        state['stages'] = {}
+
+    stages = order_stages(stages)
+    producers = stage_producers(stages)
+    by_name = {stage.name: stage for stage in stages}
+    depends = {stage.name: {producers[key] for key in stage.inputs if key in producers} for stage in stages}
+    print_plan(plan_stages(stages, state))
+
+    # Values handed over in memory, dropped once the last stage reading them is done
+    values = {}
+    readers = {}
+    for stage in stages:
+        for key in stage.inputs:
+            readers[key] = readers.get(key, 0) + 1
+    consumed = set(readers)
+    timings = {}
+    attempted = set()
+    entries = []
+    report = {'created': started.isoformat(timespec='seconds'), 'state_file': state_file, 'workers': workers,
+              'force': force, 'status': 'running', 'stages': entries}
+
+    def available(key):
+        # In memory, on disk, or produced now by rerunning its stage (needed when its CSV was never written)
+        if key in values or os.path.exists(key):
+            return True
+        producer = producers.get(key)
+        if producer is None or producer in attempted:
+            return False
+        # A producer that ran and left nothing for this key (e.g. a group with no rows) is not rerun
+        recorded = state['stages'].get(producer)
+        if recorded is not None and recorded['outputs'].get(key, [None])[0] is None:
+            return False
+        job = prepare(by_name[producer], f"needed for {key}")
+        if job is not None:
+            finish(by_name[producer], job[1], job[2], run_stage_job(*job[0]))
+        return key in values or os.path.exists(key)
+
+    def prepare(stage, reason):
+        # Arguments for running a stage, None when an input is missing
+        attempted.add(stage.name)
+        missing = [key for key in stage.inputs if not available(key)]
+        if missing:
+            # Same as the scripts always did for a group with no rows: report it and move on
+            print(f"File not found: {missing[0]}")
+            state['stages'].pop(stage.name, None)
+            entries.append({'name': stage.name, 'action': 'missing input', 'reason': missing[0]})
+            return None
+
+        print(f"Running {stage.name}: {reason}")
+        args = [values[arg] if isinstance(arg, str) and arg in stage.inputs and arg in values else arg for arg in stage.args]
+        profile_file = profile_path(profile_folder, stage.name) if profile_folder is not None else None
+        job = (stage.func, args, stage.options, stage.outputs, consumed, profile_file, trace_memory)
+
+        # Rows and trackers in as counted when the inputs were produced, bytes read for inputs taken from disk
+        rows_in, trackers_in = add_counts(input_counts(key) for key in stage.inputs)
+        measured = {'name': stage.name, 'action': 'ran', 'reason': reason, 'rows_in': rows_in, 'trackers_in': trackers_in,
+                    'bytes_read': sum(file_size(key) or 0 for key in stage.inputs if key not in values)}
+        return job, stage_record(stage, producers, state), measured
+
+    def input_counts(key):
+        producer = state['stages'].get(producers.get(key))
+        if producer is None:
+            return [None, None]
+        return producer.get('counts', {}).get(key, [None, None])
+
+    def finish(stage, record, measured, result):
+        # Keep the values later stages read and record what the stage produced
+        produced, metrics = result
+        outputs = {}
+        for key in stage.outputs:
+            file_digest_now = current_digest(key, state)
+            if key in produced:
+                # Recorded by value so it does not matter whether the CSV is written
+                values[key] = produced[key]
+                outputs[key] = [value_digest(produced[key]), file_digest_now]
+            else:
+                outputs[key] = [file_digest_now, file_digest_now]
+        record['outputs'] = outputs
+
+        # Kept with the record so the stages reading these outputs know their rows in, even in a later run
+        record['counts'] = {key: metrics['outputs'].get(key, [None, None]) for key in stage.outputs}
+        state['stages'][stage.name] = record
+        save_state(state_file, state)
+
+        rows_out, trackers_out = add_counts(record['counts'].values())
+        entries.append({**measured, 'wall_seconds': metrics['wall_seconds'], 'cpu_seconds': metrics['cpu_seconds'],
+                        'rows_out': rows_out, 'trackers_out': trackers_out,
+                        'bytes_written': written_bytes(stage.outputs, metrics['started_ns']),
+                        'peak_rss_bytes': metrics['peak_rss_bytes'], 'peak_traced_bytes': metrics['peak_traced_bytes'],
+                        'profile': metrics['profile']})
+        timings[stage.name] = metrics['wall_seconds']
+
+    def release(stage):
+        # Free the values nothing downstream still needs
+        for key in stage.inputs:
+            readers[key] -= 1
+            if readers[key] == 0:
+                values.pop(key, None)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        waiting = list(stages)
+        done = set()
+        running = {}
+        while waiting or running:
+            # Start every stage whose producers are all finished, skipped stages free up their readers at once
+            for stage in list(waiting):
+                if not depends[stage.name] <= done:
+                    continue
+                waiting.remove(stage)
+                job = None
+                if stage.name not in attempted:
+                    reason = stale_reason(stage, stage_record(stage, producers, state), state)
+                    if reason is None:
+                        print(f"Skipped {stage.name}: up to date")
+                        entries.append({'name': stage.name, 'action': 'skipped', 'reason': 'up to date'})
+                    else:
+                        job = prepare(stage, reason)
+
+                if job is None:
+                    release(stage)
+                    done.add(stage.name)
+                elif executor is None:
+                    finish(stage, job[1], job[2], run_stage_job(*job[0]))
+                    release(stage)
+                    done.add(stage.name)
+                else:
+                    running[executor.submit(run_stage_job, *job[0])] = (stage, job[1], job[2])
+
+            if running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, record, measured = running.pop(future)
+                    finish(stage, record, measured, future.result())
+                    release(stage)
+                    done.add(stage.name)
+            elif waiting and not any(depends[stage.name] <= done for stage in waiting):
+                raise ValueError("Stages left that can never run: " + ", ".join(stage.name for stage in waiting))
+        report['status'] = 'completed'
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if report_file is not None:
+            # CPU time of the stages that ran in worker processes is only in their own entries
+            if report['status'] == 'running':
+                report['status'] = 'failed'
+            report['wall_seconds'] = round(time.perf_counter() - wall, 6)
+            report['cpu_seconds'] = round(time.process_time() - cpu, 6)
+            report['peak_rss_bytes'] = peak_rss_bytes()
+            write_run_report(report_file, report)
+
+    save_state(state_file, state)
+    if timings:
+        print_timings(entries)
+    if report_file is not None:
+        print(f"Run report saved to: {report_file}")
+    return timings
@@ -0,0 +1,168 @@
+# Imports
+import math
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from TripAnalysis import trip_sequences
+from TypedTables import save_typed_frame, typed_path
+from VisitTable import load_table
+
+# Trips of a visit table as integer location codes, one trip per tracker in table order
+# ids: tracker ids (object array), names: location name of every code (sorted)
+# offsets/sequence: trip i visits sequence[offsets[i]:offsets[i + 1]] in visit order
+# previous: position of the previous visit to the same location in the same trip, -1 for a first visit
+SequenceDatabase = namedtuple('SequenceDatabase', ['ids', 'names', 'offsets', 'sequence', 'previous'])
+
+# A frequent itinerary pattern: its location codes in visit order, the number of trips visiting them in that order
+# (other visits may come between), and those trips' numbers in table order
+FrequentPattern = namedtuple('FrequentPattern', ['codes', 'support', 'trips'])
+
+PATTERN_COLUMNS = ['Pattern', 'Length', 'Count', 'Percent', 'IDs']
+
+
+# Functions
+
+def sequence_database(table):
+    # Sequence database of a visit table, e.g. the fused group-level table (grouped_Log_dataCleaned.csv)
+    ids, names, rows, location_codes, _ = trip_sequences(table)
+    n_codes = max(len(names), 1)
+    offsets = np.searchsorted(rows, np.arange(len(ids) + 1))
+    # Small codes so the per-pattern stable sorts are radix sorts
+    code_dtype = np.int16 if n_codes <= np.iinfo(np.int16).max else np.int32
+    sequence = np.asarray(location_codes, dtype=code_dtype)
+
+    # Visits sorted by (trip, location) keep their visit order, so each one follows the previous visit to its location
+    keys = rows.astype(np.int64) * n_codes + sequence
+    order = np.argsort(keys, kind='stable')
+    repeated = keys[order][1:] == keys[order][:-1]
+    previous = np.full(len(sequence), -1, dtype=np.int64)
+    previous[order[1:][repeated]] = order[:-1][repeated]
+    return SequenceDatabase(np.asarray(ids, dtype=object), names, offsets, sequence, previous)
+
+
+def support_count(min_support, n_trips):
+    # A float below 1 is a share of the trips, anything else a number of trips, never less than 1
+    if isinstance(min_support, float) and min_support < 1:
+        return max(math.ceil(min_support * n_trips), 1)
+    return max(int(min_support), 1)
+
+
+def suffix_positions(starts, ends):
+    # Every position of the ranges [starts[i], ends[i]), with the range number i of each
+    lengths = ends - starts
+    projection = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    return projection, positions
+
+
+def mine_sequences(database, min_support, max_length=None):
+    # Frequent itinerary patterns of a sequence database, PrefixSpan with pseudo-projections:
+    # a pattern's projected database is the trips containing it with the position after its earliest match in each,
+    # extending it by a location takes that location's first visit after that position
+    # min_support: trips (int) or share of trips (float below 1) a pattern must occur in
+    # max_length: longest pattern, None for no limit
+    # Returns FrequentPattern tuples, depth first in code order
+    n_codes = max(len(database.names), 1)
+    threshold = support_count(min_support, len(database.ids))
+    patterns = []
+
+    stack = [((), np.arange(len(database.ids)), database.offsets[:-1])]
+    while stack:
+        prefix, trips, starts = stack.pop()
+        if max_length is not None and len(prefix) >= max_length:
+            continue
+
+        # First visit to every location in each projected suffix, a location counts once per trip
+        projection, positions = suffix_positions(starts, database.offsets[trips + 1])
+        first = database.previous[positions] < starts[projection]
+        projection, positions = projection[first], positions[first]
+        codes = database.sequence[positions]
+        support = np.bincount(codes, minlength=n_codes)
+        frequent = support >= threshold
+        if not frequent.any():
+            continue
+
+        # Projected database of every frequent extension, trips stay in table order
+        keep = frequent[codes]
+        projection, positions, codes = projection[keep], positions[keep], codes[keep]
+        by_code = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.where(frequent, support, 0))])
+        extensions = []
+        for code in np.flatnonzero(frequent).tolist():
+            part = by_code[bounds[code]:bounds[code + 1]]
+            pattern = prefix + (code,)
+            child_trips = trips[projection[part]]
+            patterns.append(FrequentPattern(pattern, len(part), child_trips))
+            extensions.append((pattern, child_trips, positions[part] + 1))
+        stack.extend(reversed(extensions))
+
+    return patterns
+
+
+def pattern_frame(database, patterns, include_ids=True):
+    # Patterns as a frame, most frequent first, then shorter first and by location names
+    # Pattern is a tuple of location names, Percent is the share of all trips, IDs lists the trackers in table order
+    n_trips = max(len(database.ids), 1)
+    df = pd.DataFrame({
+        'Pattern': pd.Series([tuple(database.names[np.asarray(pattern.codes, dtype=np.int64)].tolist()) for pattern in patterns],
+                             dtype=object),
+        'Length': np.array([len(pattern.codes) for pattern in patterns], dtype=np.int64),
+        'Count': np.array([pattern.support for pattern in patterns], dtype=np.int64),
+    })
+    df['Percent'] = df['Count'] / n_trips * 100
+    if include_ids:
+        df['IDs'] = pd.Series([database.ids[pattern.trips].tolist() for pattern in patterns], dtype=object)
+    df = df.sort_values(['Count', 'Length', 'Pattern'], ascending=[False, True, True], kind='stable')
+    return df.reset_index(drop=True)
+
+
+def pattern_support(database, locations):
+    # Trip numbers containing the locations in this order, for checking single patterns without mining
+    names = {name: code for code, name in enumerate(database.names.tolist())}
+    if any(name not in names for name in locations):
+        return np.zeros(0, dtype=np.int64)
+    trips = np.arange(len(database.ids))
+    starts = database.offsets[:-1]
+    for code in (names[name] for name in locations):
+        projection, positions = suffix_positions(starts, database.offsets[trips + 1])
+        match = database.sequence[positions] == code
+        match &= database.previous[positions] < starts[projection]
+        trips, starts = trips[projection[match]], positions[match] + 1
+    return trips
+
+
+def find_frequent_itineraries(file_path, output_file=None, min_support=0.01, max_length=None, include_ids=True,
+                              write_typed=False):
+    # file_path is a fused wide CSV path or a visit table, the pattern frame is returned and written to output_file
+    # unless it is None, write_typed also writes its typed .npz companion
+    if isinstance(file_path, str) and not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return
+    database = sequence_database(load_table(file_path))
+    df = pattern_frame(database, mine_sequences(database, min_support, max_length), include_ids)
+
+    if output_file is not None:
+        df.to_csv(output_file, index=False)
+        if write_typed:
+            save_typed_frame(df, typed_path(output_file))
+        print(f"{len(df)} frequent itineraries saved to: {output_file}")
+
+    return df
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Fused group-level trips written by the pipeline
+    input_file = os.path.join(os.getcwd(), "ApgarOnly2min", "grouped_Log_dataCleaned.csv")
+    output_file = os.path.join(os.getcwd(), "ApgarOnly2min", "frequent_itinerariesGroupedTrips.csv")
+
+    # Share of trips a pattern must occur in (or a number of trips)
+    min_support = 0.01
+
+    # Longest pattern, None for no limit
+    max_length = None
+
+    find_frequent_itineraries(input_file, output_file, min_support, max_length)
@@ -0,0 +1,126 @@
+# Imports
+import cProfile
+import json
+import os
+import platform
+import re
+import time
+import tracemalloc
+
+import pandas as pd
+
+from VisitTable import VisitTable
+
+# resource only exists on Unix, peak RSS is reported as None without it
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RUN_REPORT_NAME = 'run_report.json'
+
+# Characters not allowed in a profile file name, stage names use '/' to show their cohort and threshold
+UNSAFE_NAME_CHARACTERS = re.compile(r'[^\w.-]+')
+
+
+# Functions
+
+def peak_rss_bytes():
+    # High-water mark of this process, ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def value_counts(value):
+    # [rows, trackers] of a visit table or frame, None where it does not apply
+    if isinstance(value, VisitTable):
+        return [len(value.visits), len(value.ids)]
+    if isinstance(value, pd.DataFrame):
+        for column in ['id', 'ID']:
+            if column in value.columns:
+                return [len(value), int(value[column].nunique())]
+        return [len(value), None]
+    return [None, None]
+
+
+def add_counts(counts):
+    # Column-wise sum of [rows, trackers] pairs, a column stays None when no pair has it
+    total = [None, None]
+    for pair in counts:
+        for index, count in enumerate(pair):
+            if count is not None:
+                total[index] = (total[index] or 0) + count
+    return total
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+def written_bytes(paths, since_ns):
+    # Bytes of the files among paths modified at or after since_ns (time.time_ns())
+    total = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            continue
+        if stat.st_mtime_ns >= since_ns:
+            total += stat.st_size
+    return total
+
+
+def profile_path(profile_folder, stage_name):
+    # <profile_folder>/<stage name>.prof, 'ApgarOnly2min/fuse_Apgar' -> 'ApgarOnly2min_fuse_Apgar.prof'
+    return os.path.join(profile_folder, UNSAFE_NAME_CHARACTERS.sub('_', stage_name) + '.prof')
+
+
+def measure_call(func, args, options, profile_file=None, trace_memory=False):
+    # Call func(*args, **options) and return its result with wall and CPU seconds and memory peaks
+    # The peak RSS is that of the process running the call, tracemalloc is only started when asked as it slows the call
+    # With a profile_file the call runs under cProfile and the stats are dumped there (pstats format)
+    tracing = trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    elif tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if profile_file is not None else None
+
+    started_ns = time.time_ns()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        result = profiler.runcall(func, *args, **options)
+    else:
+        result = func(*args, **options)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    metrics = {
+        'started_ns': started_ns,
+        'wall_seconds': round(wall, 6),
+        'cpu_seconds': round(cpu, 6),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_traced_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+        'profile': None,
+    }
+    if tracing:
+        tracemalloc.stop()
+    if profiler is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(profile_file)), exist_ok=True)
+        profiler.dump_stats(profile_file)
+        metrics['profile'] = profile_file
+    return result, metrics
+
+
+def write_run_report(report_file, report):
+    # Through a temporary file so a reader never sees half a report
+    temp_file = report_file + '.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(report, file, indent=1)
+    os.replace(temp_file, report_file)
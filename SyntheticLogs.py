@@ -0,0 +1,238 @@
+# Imports
+import math
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from LocationTaxonomy import location_filters
+
+# Groups in the order they lie along Going-to-the-Sun Road, west to east
+ROAD_ORDER = ["Apgar", "LakeMcDonald", "Avalanche", "Loop", "Logan", "SunPoint", "Waterfalls", "RisingSun", "StMary"]
+
+# Share of visits per group in the real logs, Not Sorted places are spread along the whole road
+GROUP_SHARES = {"Logan": 0.19, "Avalanche": 0.18, "Not Sorted": 0.15, "Apgar": 0.10, "Waterfalls": 0.10,
+                "LakeMcDonald": 0.09, "Loop": 0.065, "StMary": 0.036, "SunPoint": 0.035, "RisingSun": 0.031}
+
+# Polygons that show up in the real logs but are in no group
+UNLISTED_LOCATIONS = ["Gunsight_pass_trailhead", "Snyder_ridge_trail"]
+
+# Shapes fitted to DoubleFilterLogs.txt
+VISITS_MEAN = 17.5          # visits per tracker after the first, negative binomial
+VISITS_DISPERSION = 2.5
+CLIP_SHARE = 0.44           # visits under a minute
+CLIP_STEPS = [0.7, 0.2, 0.1]  # share of 15, 30 and 45 second clips
+DWELL_MEDIAN = 330.0        # seconds, lognormal for the other visits
+DWELL_SIGMA = 1.9
+GAP_MEDIAN = 200.0          # seconds between two polygons, lognormal
+GAP_SIGMA = 1.4
+STAY_IN_GROUP = 0.7         # chance the next stop is in the same group
+ROAD_FALLOFF = 0.5          # each group further along the road is half as likely as the next one
+UNLISTED_SHARE = 0.016
+START_HOURS = np.array([7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18])
+START_HOUR_WEIGHTS = np.array([40, 90, 46, 62, 41, 33, 6, 3, 25, 42, 46, 15], dtype=float)
+
+# GPS fixes come every 15 seconds, so times and durations are multiples of it
+TIME_STEP = 15
+SEASON_START = date(2023, 7, 1)
+SEASON_DAYS = 92
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Visits shorter than this are marked (CLIP)
+CLIP_SECONDS = 60
+BOM = '\ufeff'
+
+# Longest stay kept per chart row for the median, so the chart stays bounded at a million trackers
+CHART_SAMPLE = 10000
+
+
+# Functions
+
+def format_time(seconds, day_cache):
+    days, rest = divmod(int(seconds), 86400)
+    day = day_cache.get(days)
+    if day is None:
+        day = date.fromordinal(EPOCH_ORDINAL + days).isoformat()
+        day_cache[days] = day
+    hours, rest = divmod(rest, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{day} {hours:02d}:{minutes:02d}:{secs:02d}"
+
+
+def format_span(seconds):
+    # "0.0 hour(s), 12.0 minute(s), and 45.0 second(s) (765.0 seconds)" as written by the tracker software
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{float(hours)} hour(s), {float(minutes)} minute(s), and {float(secs)} second(s) ({float(seconds)} seconds)"
+
+
+def format_clock(seconds):
+    # H:MM:SS for the chart
+    return str(timedelta(seconds=int(round(seconds))))
+
+
+def move_weights(location_filters):
+    # Row i: chance of moving from group i to every other group, popular groups and near groups are favoured
+    # Groups off the road (Not Sorted and any group missing from ROAD_ORDER) are two steps from everywhere
+    groups = [group for group in location_filters if location_filters[group]]
+    position = {group: index for index, group in enumerate(ROAD_ORDER)}
+    shares = np.array([GROUP_SHARES.get(group, 0.05) for group in groups])
+    weights = np.zeros((len(groups), len(groups)))
+    for i, source in enumerate(groups):
+        for j, target in enumerate(groups):
+            if i != j:
+                steps = abs(position[source] - position[target]) if source in position and target in position else 2
+                weights[i, j] = shares[j] * ROAD_FALLOFF ** (steps - 1)
+    if len(groups) == 1:
+        weights[0, 0] = 1.0
+    return groups, shares / shares.sum(), weights / weights.sum(axis=1, keepdims=True)
+
+
+def simulate_tracker(rng, groups, shares, moves, location_filters):
+    # One visitor day: a list of (location, enter seconds, exit seconds) in time order
+    n_visits = int(rng.negative_binomial(VISITS_DISPERSION, VISITS_DISPERSION / (VISITS_DISPERSION + VISITS_MEAN))) + 1
+
+    day = SEASON_START.toordinal() - EPOCH_ORDINAL + int(rng.integers(SEASON_DAYS))
+    hour = int(rng.choice(START_HOURS, p=START_HOUR_WEIGHTS / START_HOUR_WEIGHTS.sum()))
+    time = day * 86400 + hour * 3600 + int(rng.integers(240)) * TIME_STEP + 4
+
+    group = int(rng.choice(len(groups), p=shares))
+    clips = rng.random(n_visits) < CLIP_SHARE
+    clip_steps = rng.choice(len(CLIP_STEPS), n_visits, p=CLIP_STEPS) + 1
+    dwell = rng.lognormal(math.log(DWELL_MEDIAN), DWELL_SIGMA, n_visits)
+    gaps = rng.lognormal(math.log(GAP_MEDIAN), GAP_SIGMA, n_visits)
+    draws = rng.random((n_visits, 3))
+
+    visits = []
+    for i in range(n_visits):
+        if i > 0 and draws[i, 0] >= STAY_IN_GROUP:
+            group = min(int(np.searchsorted(moves[group].cumsum(), draws[i, 1])), len(groups) - 1)
+
+        if draws[i, 2] < UNLISTED_SHARE:
+            location = UNLISTED_LOCATIONS[int(rng.integers(len(UNLISTED_LOCATIONS)))]
+        else:
+            candidates = location_filters[groups[group]]
+            location = candidates[int(rng.integers(len(candidates)))]
+
+        if clips[i]:
+            duration = TIME_STEP * int(clip_steps[i])
+        else:
+            duration = TIME_STEP * max(int(min(dwell[i], 10 * 3600) // TIME_STEP), CLIP_SECONDS // TIME_STEP)
+
+        if i > 0:
+            time += TIME_STEP * max(int(min(gaps[i], 3 * 3600) // TIME_STEP), 1)
+        visits.append((location, time, time + duration))
+        time += duration
+    return visits
+
+
+def stay_category(location, seconds):
+    # Rough stand-in for the category the tracker software prints in the summary
+    if location.startswith('Shuttle_'):
+        kind, stay = "Shuttle Stop", "Waiting For Shuttle"
+    elif 'parking' in location.lower():
+        kind, stay = "Parking Lot", "Long Stay" if seconds >= 1800 else "Short Stay"
+    elif 'trail' in location.lower():
+        kind, stay = "Short Trail", "Completed hike" if seconds >= 900 else "Incomplete hike"
+    else:
+        kind, stay = "Vistor_Areas", "Long Stay" if seconds >= 1800 else "Short Stay"
+    if seconds < 2 * CLIP_SECONDS:
+        stay = "CLIP"
+    return kind, stay
+
+
+def tracker_lines(tracker_id, index, total, visits, group_of, day_cache, chart):
+    # The lines of one "Processing group_id" block
+    lines = [f"Processing group_id: {tracker_id} ({index}/{total})",
+             f"Tracker {tracker_id} started at: {format_time(visits[0][1] - TIME_STEP * (index % 2), day_cache)}"]
+
+    poi = [visit for visit in visits if not visit[0].startswith('Shuttle_')]
+    shuttle = [visit for visit in visits if visit[0].startswith('Shuttle_')]
+    for title, suffix, section in [("Processing POI polygons:", "POI", poi),
+                                   ("Processing shuttle stop polygons:", "Shuttle Stop", shuttle)]:
+        lines.append(title)
+        for number, (location, enter, exit_time) in enumerate(section):
+            lines.append(f"Tracker {tracker_id} entered polygon '{location}' at {format_time(enter, day_cache)} ({suffix})")
+            if suffix == "POI" and number == len(section) - 1:
+                lines.append("Tracker reached the end of data. Recording final exit.")
+            lines.append(f"Tracker {tracker_id} exited polygon '{location}' at {format_time(exit_time, day_cache)} ({suffix})")
+            seconds = exit_time - enter
+            marker = f"{BOM} (CLIP)" if seconds < CLIP_SECONDS else BOM + BOM
+            lines.append(f"Tracker {tracker_id} was in '{location}' for {format_span(seconds)} ({suffix}){marker}")
+
+    # Summary of the visits that were not clips, per location in order of first stop
+    totals = {}
+    clips = 0
+    for location, enter, exit_time in visits:
+        if exit_time - enter < CLIP_SECONDS:
+            clips += 1
+        else:
+            totals[location] = totals.get(location, 0) + exit_time - enter
+    lines += ["", f"Summary for group_id {tracker_id}:",
+              f"Number of Clips: {clips}",
+              f"Number of Stops: {len(visits) - clips}",
+              f"Number of Unique POIs: {len(totals)}"]
+    lines += [f"This person spent {format_span(seconds)} at '{location}'" for location, seconds in totals.items()]
+    for location, seconds in totals.items():
+        kind, stay = stay_category(location, seconds)
+        lines.append(f"This person spent {format_span(seconds)} at '{location}' ({kind} - {stay}) ({group_of.get(location, '')})")
+        add_to_chart(chart['stays'], (location, stay), seconds)
+
+    # Itinerary is the set of groups visited, a leading blank marks stops outside every group
+    visited = {group_of.get(location, '') for location in totals}
+    itinerary = ' '.join(sorted(visited))
+    chart['itineraries'][itinerary] = chart['itineraries'].get(itinerary, 0) + 1
+
+    lines.append("")
+    return lines
+
+
+def add_to_chart(stays, key, seconds):
+    # Count, running mean and variance (Welford) and a bounded sample for the median
+    entry = stays.get(key)
+    if entry is None:
+        entry = stays[key] = [0, 0.0, 0.0, []]
+    entry[0] += 1
+    delta = seconds - entry[1]
+    entry[1] += delta / entry[0]
+    entry[2] += delta * (seconds - entry[1])
+    if len(entry[3]) < CHART_SAMPLE:
+        entry[3].append(seconds)
+
+
+def chart_lines(chart):
+    lines = ["Chart:",
+             f"{'Area Name':<20} {'Type of Stay':<20} {'Count':<10} {'Average Duration':<20} {'Median Duration':<20} {'Std Dev':<20}"]
+    for (location, stay), (count, mean, m2, sample) in sorted(chart['stays'].items()):
+        std = math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+        lines.append(f"{location:<20} {stay:<20} {count:<10} {format_clock(mean):<20} "
+                     f"{format_clock(float(np.median(sample))):<20} {format_clock(std):<20}")
+    lines += ["", "Itinerary Chart:", f"{'Itinerary':<40} {'Count':<10}"]
+    lines += [f"{itinerary:<40} {count:<10}" for itinerary, count in chart['itineraries'].items()]
+    return lines
+
+
+def generate_log(log_file_path, n_trackers, seed=0, location_filters=location_filters, chunk_trackers=1000):
+    # Write a log in the tracker software's format for n_trackers visitors, the same seed gives the same file
+    # Polygon names come from location_filters, visit counts, dwell times and gaps follow the real logs
+    rng = np.random.default_rng(seed)
+    groups, shares, moves = move_weights(location_filters)
+    group_of = {location: ('' if group == "Not Sorted" else group)
+                for group, locations in location_filters.items() for location in locations}
+    day_cache = {}
+    chart = {'stays': {}, 'itineraries': {}}
+
+    temp_file = log_file_path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8', newline='\n') as file:
+        lines = []
+        for index in range(1, n_trackers + 1):
+            tracker_id = str(10000 + index)
+            visits = simulate_tracker(rng, groups, shares, moves, location_filters)
+            lines += tracker_lines(tracker_id, index, n_trackers, visits, group_of, day_cache, chart)
+            if index % chunk_trackers == 0:
+                file.write('\n'.join(lines) + '\n')
+                lines = []
+        lines += chart_lines(chart)
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temp_file, log_file_path)
+    return log_file_path
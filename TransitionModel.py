@@ -0,0 +1,265 @@
+# Imports
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from TripAnalysis import trip_sequences
+from VisitTable import NAT, load_table
+
+# scipy is optional, without it the counts stay in their own sparse triplet form
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# Moves between consecutive locations of the fused trips, as sparse triplets sorted by (state, target)
+# names: location name of every code (sorted), order: 1 for moves from a location, 2 for moves from a pair of locations
+# states: source state of every entry (a code, or previous code * len(names) + code for order 2), targets: next location code
+# counts: moves per entry, starts / ends: trips starting / ending at every location
+TransitionCounts = namedtuple('TransitionCounts', ['names', 'order', 'states', 'targets', 'counts', 'starts', 'ends'])
+
+# First-order Markov model of the itineraries, every location either moves on or ends the trip
+# start: probability a trip starts at each location, stop: probability a trip ends after each location
+# indptr / targets / probabilities: the move probabilities of location s are probabilities[indptr[s]:indptr[s + 1]],
+# so a row's moves and its stop sum to 1
+MarkovModel = namedtuple('MarkovModel', ['names', 'start', 'stop', 'indptr', 'targets', 'probabilities'])
+
+
+# Functions
+
+def trip_codes(table):
+    # Location codes of the fused trips with the tracker row and the enter and exit time of every visit, in visit order
+    ids, names, rows, location_codes, order = trip_sequences(table)
+    enters = table.visits['enter'].to_numpy(dtype=np.int64)[order]
+    exits = table.visits['exit'].to_numpy(dtype=np.int64)[order]
+    return names, rows, np.asarray(location_codes, dtype=np.int64), enters, exits
+
+
+def trip_bounds(rows, n_trips):
+    # Index of the first and one past the last visit of every trip that has visits
+    bounds = np.searchsorted(rows, np.arange(n_trips + 1))
+    has_visits = bounds[1:] > bounds[:-1]
+    return bounds[:-1][has_visits], bounds[1:][has_visits]
+
+
+def visit_hours(times):
+    # Hour of day of epoch seconds, -1 where the time is missing
+    return np.where(times != NAT, times // 3600 % 24, -1)
+
+
+def count_moves(names, order, keys, starts, ends):
+    # Sparse triplets of move keys (state * len(names) + target), counted with one np.unique
+    n_names = max(len(names), 1)
+    entries, counts = np.unique(keys, return_counts=True)
+    return TransitionCounts(names, order, entries // n_names, entries % n_names, counts.astype(np.int64), starts, ends)
+
+
+def transition_counts(table, order=1, hours=None):
+    # Moves between consecutive locations of every trip of a visit table, all trackers in one vectorized pass
+    # The fused polygon-level table (formatted_log_dataCleaned.csv) gives polygon moves, the grouped one group moves
+    # order=2 counts moves from the last two locations; hours: only moves leaving in these hours of day (0-23)
+    names, rows, codes, enters, exits = trip_codes(table)
+    n_names = max(len(names), 1)
+
+    # Moves stay inside a trip, a move of order 2 needs the two visits before it in the same trip
+    same = rows[order:] == rows[:-order] if len(rows) > order else np.zeros(0, dtype=bool)
+    states = codes[:len(codes) - order] if order == 1 else codes[:len(codes) - 2] * n_names + codes[1:len(codes) - 1]
+    targets = codes[order:]
+    # A move leaves when the visit just before it is exited
+    leave_hours = visit_hours(exits[order - 1:len(exits) - 1])
+    if hours is not None:
+        same &= np.isin(leave_hours, list(hours))
+
+    # Trip first and last locations, for the start and stop of the Markov model, by the hour the trip starts / ends
+    first, stop = trip_bounds(rows, len(table.ids))
+    last = stop - 1
+    if hours is not None:
+        first = first[np.isin(visit_hours(enters[first]), list(hours))]
+        last = last[np.isin(visit_hours(exits[last]), list(hours))]
+    starts = np.bincount(codes[first], minlength=len(names))
+    ends = np.bincount(codes[last], minlength=len(names))
+    return count_moves(names, order, states[same] * n_names + targets[same], starts, ends)
+
+
+def hourly_transition_counts(table, order=1):
+    # {hour of day: transition counts of the moves leaving in that hour}, from one pass over the moves
+    # Trips start in the hour of their first enter and end in the hour of their last exit, as with transition_counts(hours=...)
+    # Moves leaving a visit without an exit time are left out
+    names, rows, codes, enters, exits = trip_codes(table)
+    n_names = max(len(names), 1)
+    n_states = n_names ** order
+    same = rows[order:] == rows[:-order] if len(rows) > order else np.zeros(0, dtype=bool)
+    states = codes[:len(codes) - order] if order == 1 else codes[:len(codes) - 2] * n_names + codes[1:len(codes) - 1]
+    leave_hours = visit_hours(exits[order - 1:len(exits) - 1])
+    same &= leave_hours >= 0
+    keys = (leave_hours[same] * n_states + states[same]) * n_names + codes[order:][same]
+
+    entries, counts = np.unique(keys, return_counts=True)
+    entry_hours = entries // (n_states * n_names)
+    bounds = np.searchsorted(entry_hours, np.arange(25))
+
+    # Trip starts and ends per (hour, location), missing times fall outside every hour
+    first, stop = trip_bounds(rows, len(table.ids))
+    start_hours = visit_hours(enters[first])
+    end_hours = visit_hours(exits[stop - 1])
+    starts = np.bincount((start_hours * n_names + codes[first])[start_hours >= 0], minlength=24 * n_names).reshape(24, n_names)
+    ends = np.bincount((end_hours * n_names + codes[stop - 1])[end_hours >= 0], minlength=24 * n_names).reshape(24, n_names)
+
+    hourly = {}
+    for hour in range(24):
+        part = slice(bounds[hour], bounds[hour + 1])
+        moves = entries[part] % (n_states * n_names)
+        hourly[hour] = TransitionCounts(names, order, moves // n_names, moves % n_names, counts[part].astype(np.int64),
+                                        starts[hour, :len(names)], ends[hour, :len(names)])
+    return hourly
+
+
+def sparse_matrix(counts):
+    # The counts as a scipy CSR matrix, states by target locations
+    if sparse is None:
+        raise ImportError("scipy is needed for sparse_matrix, transition_frame gives the same counts as a frame")
+    n_names = len(counts.names)
+    return sparse.csr_matrix((counts.counts, (counts.states, counts.targets)), shape=(n_names ** counts.order, n_names))
+
+
+def state_names(counts):
+    # Location names of every source state, joined with ' > ' for moves of order 2
+    names = counts.names
+    if counts.order == 1:
+        return names[counts.states]
+    n_names = len(names)
+    return np.char.add(np.char.add(names[counts.states // n_names].astype(str), ' > '),
+                       names[counts.states % n_names].astype(str)).astype(object)
+
+
+def transition_frame(counts):
+    # One row per move with its count and its share of the moves leaving the same state
+    df = pd.DataFrame({
+        'From': state_names(counts),
+        'To': counts.names[counts.targets],
+        'Count': counts.counts,
+    })
+    state_totals = np.bincount(counts.states, weights=counts.counts)
+    df['Probability'] = counts.counts / state_totals[counts.states] if len(counts.counts) else np.zeros(0)
+    return df
+
+
+def markov_model(counts):
+    # Row-normalized first-order model, a location's moves and trip ends share its probability mass
+    if counts.order != 1:
+        raise ValueError("markov_model needs first-order transition counts")
+    n_names = len(counts.names)
+    leaving = np.bincount(counts.states, weights=counts.counts, minlength=n_names) + counts.ends
+    # Locations no trip visits keep all-zero rows
+    totals = np.where(leaving > 0, leaving, 1)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(counts.states, minlength=n_names))])
+    start = counts.starts / max(counts.starts.sum(), 1)
+    return MarkovModel(counts.names, start, counts.ends / totals, indptr, counts.targets,
+                       counts.counts / totals[counts.states])
+
+
+def simulate_itineraries(model, n_itineraries, seed=0, max_length=100):
+    # Itineraries drawn from the model, as tuples of location names; every walker moves in the same vectorized step
+    # A move is picked by searching state + uniform draw in the running sums of the rows offset by their state,
+    # a draw past a row's moves (in its stop mass) ends the trip
+    rng = np.random.default_rng(seed)
+    n_names = len(model.names)
+    row_of_move = np.repeat(np.arange(n_names), np.diff(model.indptr))
+    running = np.concatenate([[0], np.cumsum(model.probabilities)])
+    keys = row_of_move + running[1:] - running[model.indptr[:-1]][row_of_move]
+    move_mass = np.bincount(row_of_move, weights=model.probabilities, minlength=n_names)
+
+    current = rng.choice(n_names, n_itineraries, p=model.start)
+    paths = [current]
+    active = np.ones(n_itineraries, dtype=bool)
+    for _ in range(max_length - 1):
+        draws = rng.random(n_itineraries)
+        active &= draws < move_mass[current]
+        if not active.any():
+            break
+        # Clamped to the row's last move in case rounding puts a draw just past it
+        picks = np.minimum(np.searchsorted(keys, current + draws, side='right'), model.indptr[current + 1] - 1)
+        current = np.where(active, model.targets[np.maximum(picks, 0)], -1)
+        paths.append(current)
+        current = np.maximum(current, 0)
+
+    steps = np.stack(paths, axis=1)
+    return [tuple(model.names[path[path >= 0]].tolist()) for path in steps]
+
+
+def score_trips(model, table):
+    # Log-likelihood of every trip of a visit table under the model, -inf for a trip with a move the model never saw
+    names, rows, codes, _, _ = trip_codes(table)
+    model_codes = {name: code for code, name in enumerate(model.names.tolist())}
+    codes = np.array([model_codes.get(name, -1) for name in names.tolist()], dtype=np.int64)[codes] if len(codes) else codes
+    n_names = len(model.names)
+    n_trips = len(table.ids)
+
+    # Every move looked up among the model's sorted (location, target) keys
+    model_keys = np.repeat(np.arange(n_names), np.diff(model.indptr)) * n_names + model.targets
+    same = rows[1:] == rows[:-1]
+    sources, targets = codes[:-1][same], codes[1:][same]
+    keys = sources * n_names + targets
+    found = np.searchsorted(model_keys, keys)
+    known = (sources >= 0) & (targets >= 0) & (found < len(model_keys))
+    known[known] = model_keys[found[known]] == keys[known]
+    move_scores = np.full(len(keys), -np.inf)
+
+    first, stop = trip_bounds(rows, n_trips)
+    has_visits = np.zeros(n_trips, dtype=bool)
+    has_visits[rows[first]] = True
+    with np.errstate(divide='ignore'):
+        move_scores[known] = np.log(model.probabilities[found[known]])
+        start_scores = np.full(len(first), -np.inf)
+        stop_scores = np.full(len(first), -np.inf)
+        start_scores[codes[first] >= 0] = np.log(model.start[codes[first][codes[first] >= 0]])
+        stop_scores[codes[stop - 1] >= 0] = np.log(model.stop[codes[stop - 1][codes[stop - 1] >= 0]])
+
+    scores = np.zeros(n_trips)
+    scores[has_visits] = start_scores + stop_scores
+    return scores + np.bincount(rows[1:][same], weights=move_scores, minlength=n_trips)
+
+
+def score_itinerary(model, locations):
+    # Log-likelihood of one itinerary, e.g. ('Apgar', 'Avalanche', 'Logan')
+    codes = {name: code for code, name in enumerate(model.names.tolist())}
+    if not locations or any(name not in codes for name in locations):
+        return -np.inf
+    path = [codes[name] for name in locations]
+    with np.errstate(divide='ignore'):
+        score = np.log(model.start[path[0]]) + np.log(model.stop[path[-1]])
+        for source, target in zip(path[:-1], path[1:]):
+            row = slice(model.indptr[source], model.indptr[source + 1])
+            match = np.flatnonzero(model.targets[row] == target)
+            score += np.log(model.probabilities[row][match[0]]) if len(match) else -np.inf
+    return float(score)
+
+
+def find_transitions(file_path, output_file=None, order=1):
+    # file_path is a fused wide CSV path or a visit table, the move frame is returned and written to output_file unless it is None
+    if isinstance(file_path, str) and not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return
+    df = transition_frame(transition_counts(load_table(file_path), order))
+    if output_file is not None:
+        df.to_csv(output_file, index=False)
+        print(f"{len(df)} transitions saved to: {output_file}")
+    return df
+
+
+# Main Execution
+if __name__ == "__main__":
+    # Fused trips written by the pipeline, polygon level and group level
+    output_folder = os.path.join(os.getcwd(), "ApgarOnly2min")
+    tables = {
+        'FullTrips': os.path.join(output_folder, "formatted_log_dataCleaned.csv"),
+        'GroupedTrips': os.path.join(output_folder, "grouped_Log_dataCleaned.csv"),
+    }
+
+    # 1 for moves between two locations, 2 for moves from the last two locations
+    order = 1
+
+    for name, input_file in tables.items():
+        find_transitions(input_file, os.path.join(output_folder, f"transitions{name}.csv"), order)
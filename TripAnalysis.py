@@ -0,0 +1,214 @@
+# Imports
+import numpy as np
+import pandas as pd
+
+from VisitTable import NAT, format_timestamps
+
+# Per tracker values collected into lists by the grouped outputs
+TRIP_VALUE_COLUMNS = ['Total_Duration_POI', 'Trip_Start_Time', 'Trip_End_Time', 'Total_Trip_Duration']
+
+
+# Functions
+
+def intern_sequences(rows, codes, n_rows):
+    # Give every distinct per-row sequence of codes one integer key, numbered in order of first appearance
+    # rows must be sorted, codes are packed into one byte buffer so each sequence becomes a hashable bytes key
+    bounds = np.searchsorted(rows, np.arange(n_rows + 1))
+    buffer = np.asarray(codes, dtype='<u4').tobytes()
+    sequences = [buffer[4 * start:4 * end] for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+    keys, unique_sequences = pd.factorize(pd.Series(sequences, dtype=object))
+    return keys, [np.frombuffer(sequence, dtype='<u4') for sequence in unique_sequences]
+
+
+def trip_groups(keys, n_keys, columns):
+    # Collect the per tracker values of every key into lists, trackers stay in input order inside a key
+    order = np.argsort(keys, kind='stable')
+    bounds = np.searchsorted(keys[order], np.arange(n_keys + 1))
+    pairs = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    grouped = {}
+    for name, values in columns.items():
+        ordered = np.asarray(values, dtype=object)[order].tolist()
+        grouped[name] = [ordered[start:end] for start, end in pairs]
+    grouped['Count'] = np.diff(bounds)
+    return grouped
+
+
+def trip_sequences(table):
+    # Visits of a table as location codes per tracker
+    # Returns ids, sorted location names, the tracker row of every visit (sorted), the visit location codes
+    # (in visit order within a tracker) and the order that sorts the table's visits that way
+    ids = list(table.ids)
+    visits = table.visits
+
+    # Roster row of every visit, visits of a tracker stay in visit order
+    rows = pd.Index(ids).get_indexer(visits['id'])
+    order = np.argsort(rows, kind='stable')
+    rows = rows[order]
+    locations = visits['location'].to_numpy(dtype=object)[order].astype(str).astype(object)
+
+    # Location codes follow the sorted location names, so sorted codes give sorted unique location sets
+    codes, uniques = pd.factorize(locations)
+    name_order = np.argsort(np.asarray(uniques, dtype=object))
+    names = np.asarray(uniques, dtype=object)[name_order]
+    name_rank = np.empty(len(names), dtype=np.int64)
+    name_rank[name_order] = np.arange(len(names))
+    location_codes = name_rank[codes]
+    return ids, names, rows, location_codes, order
+
+
+def trip_columns(table):
+    # Visits of a table as location codes per tracker plus the per tracker trip values
+    # Returns ids, sorted location names, the tracker row of every visit (sorted), the visit location codes
+    # (in visit order within a tracker) and {value column: per tracker list}
+    ids, names, rows, location_codes, order = trip_sequences(table)
+    n_rows = len(ids)
+    visits = table.visits
+    durations = visits['duration'].to_numpy(dtype=np.float64)[order]
+    enter_times = visits['enter'].to_numpy(dtype=np.int64)[order]
+    exit_times = visits['exit'].to_numpy(dtype=np.int64)[order]
+
+    # Total POI duration, trackers without any duration keep the integer 0
+    has_duration = ~np.isnan(durations)
+    totals = np.bincount(rows[has_duration], weights=durations[has_duration], minlength=n_rows)
+    duration_counts = np.bincount(rows[has_duration], minlength=n_rows)
+    total_duration = totals.astype(object)
+    total_duration[duration_counts == 0] = 0
+
+    # Trip start is the earliest enter time and trip end the latest exit time
+    start_times = np.full(n_rows, NAT, dtype=np.int64)
+    end_times = np.full(n_rows, NAT, dtype=np.int64)
+    has_enter = enter_times != NAT
+    has_exit = exit_times != NAT
+    start_min = pd.Series(enter_times[has_enter]).groupby(rows[has_enter]).min()
+    end_max = pd.Series(exit_times[has_exit]).groupby(rows[has_exit]).max()
+    start_times[start_min.index.to_numpy()] = start_min.to_numpy()
+    end_times[end_max.index.to_numpy()] = end_max.to_numpy()
+
+    has_start = start_times != NAT
+    has_end = end_times != NAT
+    formatted_start_time = np.where(has_start, format_timestamps(start_times), None)
+    formatted_end_time = np.where(has_end, format_timestamps(end_times), None)
+
+    # Total trip duration in minutes
+    trip_duration = np.full(n_rows, None, dtype=object)
+    both = has_start & has_end
+    trip_duration[both] = ((end_times[both] - start_times[both]) / 60).astype(object)
+
+    values = {
+        'Total_Duration_POI': total_duration.tolist(),
+        'Trip_Start_Time': formatted_start_time.tolist(),
+        'Trip_End_Time': formatted_end_time.tolist(),
+        'Total_Trip_Duration': trip_duration.tolist(),
+    }
+    return ids, names, rows, location_codes, values
+
+
+def summarize_trips(table):
+    # Per tracker trip order, unique locations, POI duration and start/end time
+    # Returns the individual order, individual unique, grouped order and grouped unique frames
+    ids, names, rows, location_codes, values = trip_columns(table)
+    n_rows = len(ids)
+
+    # Intern each trip order and each unique location set to an integer key
+    order_keys, order_sequences = intern_sequences(rows, location_codes, n_rows)
+    pairs = np.unique(rows.astype(np.int64) * max(len(names), 1) + location_codes)
+    unique_keys, unique_sequences = intern_sequences(pairs // max(len(names), 1), pairs % max(len(names), 1), n_rows)
+    trip_orders = [tuple(names[sequence].tolist()) for sequence in order_sequences]
+    unique_sets = [tuple(names[sequence].tolist()) for sequence in unique_sequences]
+
+    # Individual trip data
+    order_df = pd.DataFrame({'ID': ids, 'Trip_Order': [trip_orders[key] for key in order_keys], **values})
+    unique_df = pd.DataFrame({'ID': ids, 'Unique_Locations': [unique_sets[key] for key in unique_keys], **values})
+
+    # Grouped trip data, one row per trip order / unique set in order of first appearance
+    grouped_columns = ['IDs', 'Count'] + TRIP_VALUE_COLUMNS
+    grouped_order = trip_groups(order_keys, len(trip_orders), {'IDs': ids, **values})
+    grouped_order_df = pd.DataFrame({'Trip_Order': trip_orders, **grouped_order}, columns=['Trip_Order'] + grouped_columns)
+    grouped_unique = trip_groups(unique_keys, len(unique_sets), {'IDs': ids, **values})
+    grouped_unique_df = pd.DataFrame({'Unique_Locations': unique_sets, **grouped_unique}, columns=['Unique_Locations'] + grouped_columns)
+
+    return order_df, unique_df, grouped_order_df, grouped_unique_df
+
+
+def group_columns(individual_df):
+    # IDs and per tracker values of an individual order or unique frame, as the grouped outputs list them
+    columns = {'IDs': individual_df['ID'].tolist(), **{name: individual_df[name].tolist() for name in TRIP_VALUE_COLUMNS}}
+
+    # The individual frames hold these as float columns, the lists keep the values summarize_trips collected:
+    # the integer 0 for trackers without any duration (totals of real durations are never 0) and None for missing trip times
+    columns['Total_Duration_POI'] = [0 if value == 0 else value for value in columns['Total_Duration_POI']]
+    columns['Total_Trip_Duration'] = [None if pd.isna(value) else value for value in columns['Total_Trip_Duration']]
+    return columns
+
+
+def group_trips(individual_df, key_column):
+    # Grouped frame of an individual order or unique frame, one row per trip order / unique set in order of
+    # first appearance, the same frame summarize_trips returns for the table the individual rows came from
+    keys, uniques = pd.factorize(pd.Series(individual_df[key_column].tolist(), dtype=object))
+    grouped = trip_groups(keys, len(uniques), group_columns(individual_df))
+    return pd.DataFrame({key_column: list(uniques), **grouped}, columns=[key_column, 'IDs', 'Count'] + TRIP_VALUE_COLUMNS)
+
+
+def update_trip_groups(groups, removed_df, added_df, key_column):
+    # groups: {trip order / unique set: (IDs, one list per TRIP_VALUE_COLUMNS)} with the trackers of each in id order,
+    # updated in place: the rows of removed_df leave their key and the rows of added_df join theirs,
+    # only the keys they touch are rebuilt
+    removed = {}
+    for tracker_id, key in zip(removed_df['ID'].tolist(), removed_df[key_column].tolist()):
+        removed.setdefault(key, set()).add(tracker_id)
+    added = {}
+    for key, *row in zip(added_df[key_column].tolist(), *group_columns(added_df).values()):
+        added.setdefault(key, []).append(tuple(row))
+
+    for key in set(removed) | set(added):
+        gone = removed.get(key, set())
+        rows = [row for row in zip(*groups[key]) if row[0] not in gone] if key in groups else []
+        rows.extend(added.get(key, []))
+        if rows:
+            rows.sort(key=lambda row: row[0])
+            groups[key] = tuple(list(column) for column in zip(*rows))
+        else:
+            groups.pop(key, None)
+    return groups
+
+
+def grouped_frame(groups, key_column):
+    # Grouped frame of update_trip_groups' groups, keys in order of their first tracker as in group_trips
+    keys = sorted(groups, key=lambda key: groups[key][0][0])
+    columns = {key_column: keys, 'Count': np.array([len(groups[key][0]) for key in keys], dtype=np.int64)}
+    for index, name in enumerate(['IDs'] + TRIP_VALUE_COLUMNS):
+        columns[name] = [list(groups[key][index]) for key in keys]
+    return pd.DataFrame(columns, columns=[key_column, 'IDs', 'Count'] + TRIP_VALUE_COLUMNS)
+
+
+def merge_trip_summaries(previous, current, replaced_ids, groups=None):
+    # previous: individual (order, unique) frames of the trackers summarized before, None for none
+    # current: summarize_trips of a table holding only new or changed trackers, None for none
+    # groups: (order, unique) groups of update_trip_groups for the previous rows, updated in place; None builds them
+    # from every row
+    # Rows of replaced_ids in previous are dropped, the current rows take their place, so old trackers are not summarized
+    # again and only the trip orders / unique sets they leave or join are regrouped
+    # Returns the four frames summarize_trips would give for every tracker, rows in id order like the tables they come from
+    frames = []
+    for index in range(2):
+        parts = []
+        if previous is not None:
+            parts.append(previous[index][~previous[index]['ID'].isin(replaced_ids)])
+        if current is not None:
+            parts.append(current[index])
+        parts = [part for part in parts if len(part)] or parts[:1]
+        merged = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+        # Column types as if every row had been built at once (0 and 0.0 from different parts become 0.0)
+        frames.append(merged.sort_values('ID', kind='stable').reset_index(drop=True).infer_objects())
+
+    order_df, unique_df = frames
+    if groups is None:
+        return order_df, unique_df, group_trips(order_df, 'Trip_Order'), group_trips(unique_df, 'Unique_Locations')
+
+    grouped = []
+    for index, key_column in enumerate(['Trip_Order', 'Unique_Locations']):
+        removed_df = previous[index][previous[index]['ID'].isin(replaced_ids)] if previous is not None else frames[index][:0]
+        added_df = current[index] if current is not None else frames[index][:0]
+        grouped.append(grouped_frame(update_trip_groups(groups[index], removed_df, added_df, key_column), key_column))
+    return order_df, unique_df, grouped[0], grouped[1]
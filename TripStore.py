@@ -0,0 +1,237 @@
+# Imports
+from collections import namedtuple
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from TripAnalysis import intern_sequences, trip_columns, TRIP_VALUE_COLUMNS
+
+# Trip orders of a visit table as integer location codes, with a prefix trie over them
+# ids: tracker ids (object array), one trip per tracker in table order
+# names: location name of every code (sorted), codes: {location name: code}
+# offsets/sequence: trip i visits sequence[offsets[i]:offsets[i + 1]] in visit order
+# keys: distinct trip order of every trip, numbered in order of first appearance, order_nodes: trie node of every key
+# values: {value column: per trip list} as written to the analysis CSVs
+# Trie node 0 is the empty prefix, node n extends parent[n] by location code[n], children[n] is {code: child node}
+# prefix_count / end_count: trips that start with / are exactly the node's itinerary, duration_sum: Total_Duration_POI of
+# the trips starting with it
+# trips: trip numbers in trie order, the trips starting with node n's itinerary are trips[first[n]:last[n]]
+# postings: {code: sorted numbers of the trips that visit the location}
+TripStore = namedtuple('TripStore', ['ids', 'names', 'codes', 'offsets', 'sequence', 'keys', 'order_nodes', 'values',
+                                     'parent', 'code', 'children', 'prefix_count', 'end_count', 'duration_sum',
+                                     'trips', 'first', 'last', 'postings'])
+
+
+# Functions
+
+def build_trip_store(table):
+    # Store of the trip orders of a visit table (e.g. a fused table from load_table), one trip per tracker
+    ids, names, rows, location_codes, values = trip_columns(table)
+    n_trips = len(ids)
+    offsets = np.searchsorted(rows, np.arange(n_trips + 1))
+    sequence = np.asarray(location_codes, dtype=np.int32)
+    keys, orders = intern_sequences(rows, location_codes, n_trips)
+
+    # Trips and POI duration per distinct trip order, trackers without any duration count as 0
+    durations = np.array([float(value) for value in values['Total_Duration_POI']], dtype=np.float64)
+    key_counts = np.bincount(keys, minlength=len(orders))
+    key_durations = np.bincount(keys, weights=durations, minlength=len(orders))
+
+    # Insert the distinct trip orders in sorted order, so the trips under any node form one run of trie order
+    ranks = sorted(range(len(orders)), key=lambda key: orders[key].tolist())
+    key_end = np.cumsum(key_counts[ranks]) if len(orders) else np.zeros(0, dtype=np.int64)
+    key_start = key_end - key_counts[ranks] if len(orders) else key_end
+    parent = [-1]
+    code = [-1]
+    children = [{}]
+    first = [0]
+    last = [n_trips]
+    order_nodes = np.zeros(len(orders), dtype=np.int64)
+    for rank, key in enumerate(ranks):
+        node = 0
+        for location in orders[key].tolist():
+            child = children[node].get(location)
+            if child is None:
+                child = len(parent)
+                children[node][location] = child
+                parent.append(node)
+                code.append(location)
+                children.append({})
+                first.append(int(key_start[rank]))
+                last.append(0)
+            last[child] = int(key_end[rank])
+            node = child
+        order_nodes[key] = node
+
+    # Counts and durations of the exact itineraries, summed up the tree (children are always numbered after their parent)
+    parent = np.asarray(parent, dtype=np.int64)
+    n_nodes = len(parent)
+    end_count = np.bincount(order_nodes, weights=key_counts, minlength=n_nodes).astype(np.int64)
+    prefix_count = end_count.copy()
+    duration_sum = np.bincount(order_nodes, weights=key_durations, minlength=n_nodes)
+    for node in range(n_nodes - 1, 0, -1):
+        prefix_count[parent[node]] += prefix_count[node]
+        duration_sum[parent[node]] += duration_sum[node]
+
+    # Trip numbers in trie order, trips with the same itinerary stay in table order
+    rank_of_key = np.empty(len(orders), dtype=np.int64)
+    rank_of_key[ranks] = np.arange(len(orders))
+    trips = np.lexsort((np.arange(n_trips), rank_of_key[keys])) if n_trips else np.zeros(0, dtype=np.int64)
+
+    # Trips per location, for containment queries
+    n_codes = max(len(names), 1)
+    pairs = np.unique(rows.astype(np.int64) * n_codes + location_codes)
+    pair_codes = pairs % n_codes
+    by_code = np.argsort(pair_codes, kind='stable')
+    bounds = np.searchsorted(pair_codes[by_code], np.arange(len(names) + 1))
+    postings = {location: (pairs // n_codes)[by_code[bounds[location]:bounds[location + 1]]] for location in range(len(names))}
+
+    return TripStore(np.asarray(ids, dtype=object), names, {name: index for index, name in enumerate(names.tolist())},
+                     offsets, sequence, keys, order_nodes, values, parent, np.asarray(code, dtype=np.int64), children,
+                     prefix_count, end_count, duration_sum, trips, np.asarray(first, dtype=np.int64),
+                     np.asarray(last, dtype=np.int64), postings)
+
+
+def encode_locations(store, locations):
+    # Codes of location names, None when a name does not occur in the store
+    try:
+        return [store.codes[name] for name in locations]
+    except KeyError:
+        return None
+
+
+def trip_locations(store, trip):
+    # Itinerary of one trip as location names
+    return store.names[store.sequence[store.offsets[trip]:store.offsets[trip + 1]]].tolist()
+
+
+def node_path(store, node):
+    # Location codes from the root to a node
+    path = []
+    while node > 0:
+        path.append(int(store.code[node]))
+        node = store.parent[node]
+    return path[::-1]
+
+
+def find_prefix(store, locations):
+    # Trie node of an itinerary prefix, -1 when no trip starts with it
+    codes = encode_locations(store, locations)
+    if codes is None:
+        return -1
+    node = 0
+    for location in codes:
+        node = store.children[node].get(location, -1)
+        if node < 0:
+            return -1
+    return node
+
+
+def count_prefix(store, locations):
+    # Trips whose itinerary starts with the locations, e.g. ['Apgar', 'Avalanche']
+    node = find_prefix(store, locations)
+    return int(store.prefix_count[node]) if node >= 0 else 0
+
+
+def count_trip_order(store, locations):
+    # Trips with exactly this itinerary
+    node = find_prefix(store, locations)
+    return int(store.end_count[node]) if node >= 0 else 0
+
+
+def prefix_duration(store, locations):
+    # Summed Total_Duration_POI of the trips starting with the locations
+    node = find_prefix(store, locations)
+    return float(store.duration_sum[node]) if node >= 0 else 0.0
+
+
+def prefix_trips(store, locations):
+    # Trip numbers (table rows) of the trips starting with the locations, in table order
+    node = find_prefix(store, locations)
+    if node < 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(store.trips[store.first[node]:store.last[node]])
+
+
+def ids_with_prefix(store, locations):
+    return store.ids[prefix_trips(store, locations)].tolist()
+
+
+def next_locations(store, locations):
+    # {next location: trips continuing with it} after an itinerary prefix
+    node = find_prefix(store, locations)
+    if node < 0:
+        return {}
+    return {store.names[location]: int(store.prefix_count[child]) for location, child in store.children[node].items()}
+
+
+def trips_containing(store, locations, adjacent=False):
+    # Trip numbers of the trips visiting the locations in this order anywhere in the trip, in table order
+    # adjacent=True only counts them as consecutive visits; candidates come from intersecting the per location trip lists
+    # and are checked together, one array step per query location
+    codes = encode_locations(store, locations)
+    if codes is None:
+        return np.zeros(0, dtype=np.int64)
+    if not codes:
+        return np.arange(len(store.ids))
+    candidates = reduce(np.intersect1d, sorted((store.postings[location] for location in set(codes)), key=len))
+    if len(codes) == 1 or not len(candidates):
+        return candidates
+    sequence, offsets = store.sequence, store.offsets
+
+    if adjacent:
+        # Every visit to the first location in a candidate trip with room for the rest, kept while the visits after
+        # it match the rest of the locations
+        positions = np.flatnonzero(sequence == codes[0])
+        position_trips = np.searchsorted(offsets, positions, side='right') - 1
+        keep = np.isin(position_trips, candidates) & (positions + len(codes) <= offsets[position_trips + 1])
+        positions, position_trips = positions[keep], position_trips[keep]
+        for step, location in enumerate(codes[1:], 1):
+            keep = sequence[positions + step] == location
+            positions, position_trips = positions[keep], position_trips[keep]
+        return np.unique(position_trips)
+
+    # Earliest match of the locations so far in every candidate trip: the next visit to each location is found
+    # among that location's visit positions, which are sorted by trip, with one search over all candidates
+    trips = candidates
+    starts = offsets[trips]
+    for location in codes:
+        positions = np.flatnonzero(sequence == location)
+        following = np.searchsorted(positions, starts)
+        matched = following < len(positions)
+        following = positions[np.minimum(following, len(positions) - 1)]
+        matched &= following < offsets[trips + 1]
+        trips, starts = trips[matched], following[matched] + 1
+    return trips
+
+
+def count_containing(store, locations, adjacent=False):
+    return len(trips_containing(store, locations, adjacent))
+
+
+def grouped_order_frame(store):
+    # The grouped order frame of summarize_trips (one row per itinerary in order of first appearance), from the store
+    # Itineraries are the paths of the trie nodes, and the trips of each are one run of trie order: the trips ending
+    # at a node come before those continuing past it, in table order
+    paths = [()]
+    for node in range(1, len(store.parent)):
+        paths.append(paths[store.parent[node]] + (store.names[store.code[node]],))
+    nodes = store.order_nodes
+    counts = store.end_count[nodes]
+    starts = store.first[nodes]
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    positions = np.arange(bounds[-1]) - np.repeat(bounds[:-1] - starts, counts)
+    trips = store.trips[positions]
+    pairs = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    grouped = {'Trip_Order': [paths[node] for node in nodes.tolist()]}
+    for name, values in {'IDs': store.ids, **store.values}.items():
+        ordered = np.asarray(values, dtype=object)[trips].tolist()
+        grouped[name] = [ordered[start:end] for start, end in pairs]
+    grouped['Count'] = counts
+    return pd.DataFrame(grouped, columns=['Trip_Order', 'IDs', 'Count'] + TRIP_VALUE_COLUMNS)
+
+
+def write_grouped_order_csv(store, output_file_path):
+    grouped_order_frame(store).to_csv(output_file_path, index=False)
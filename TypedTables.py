@@ -0,0 +1,207 @@
+# Imports
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Analysis columns holding a tuple or list per row, written to CSV as Python reprs
+# The value columns are lists in the grouped outputs only, so a CSV column is parsed when its cells look like lists
+LIST_COLUMNS = {
+    'Trip_Order': tuple,
+    'Pattern': tuple,
+    'Unique_Locations': tuple,
+    'IDs': list,
+    'Total_Duration_POI': list,
+    'Trip_Start_Time': list,
+    'Trip_End_Time': list,
+    'Total_Trip_Duration': list,
+}
+
+# Typed companions sit next to the CSV, e.g. grouped_unique_trips_with_timesFullTrips.npz
+TYPED_SUFFIX = '.npz'
+
+# Bump when the layout changes, older files are then read from the CSV instead
+TYPED_VERSION = 1
+
+# One item of a flat list or tuple repr: a quoted string, None, or a number
+LIST_ITEM_PATTERN = re.compile(r"""'([^']*)'|"([^"]*)"|(None)|([-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|nan|inf))""")
+
+
+# Functions
+
+def typed_path(csv_path):
+    return os.path.splitext(csv_path)[0] + TYPED_SUFFIX
+
+
+def parse_literal_list(text):
+    # Items of a flat list or tuple repr of strings, None and numbers, e.g. "('Apgar', 'Avalanche')" or "[4124.0, None]"
+    # A parser, not eval, so a cell can never run code; names with quotes inside both quote styles are not supported
+    if not isinstance(text, str):
+        return []
+    items = []
+    for single, double, none, number in LIST_ITEM_PATTERN.findall(text):
+        if number:
+            items.append(float(number) if any(c in number for c in '.eEna') else int(number))
+        elif none:
+            items.append(None)
+        else:
+            items.append(single or double)
+    return items
+
+
+def holds_lists(cells):
+    # Whether a CSV column's cells are list or tuple reprs, judged by the first filled cell
+    for cell in cells:
+        if isinstance(cell, str):
+            return cell[:1] in ('[', '(')
+    return False
+
+
+def column_kind(values):
+    # 'str' when every non-missing item is text, else 'float'
+    for value in values:
+        if value is not None and not (isinstance(value, float) and np.isnan(value)):
+            return 'str' if isinstance(value, str) else 'float'
+    return 'float'
+
+
+def encode_values(values):
+    # Flat items to typed arrays: text as codes into a unique string array (-1 for missing), numbers as float64,
+    # with the type of every item (0 float, 1 int, 2 None) kept only when they are not all floats
+    if column_kind(values) == 'str':
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        return {'codes': codes.astype(np.int32), 'uniques': np.asarray(uniques, dtype=str)}
+    item_types = np.fromiter((2 if value is None else 1 if isinstance(value, (int, np.integer)) else 0 for value in values),
+                             dtype=np.int8, count=len(values))
+    arrays = {'numbers': np.array([np.nan if value is None else value for value in values], dtype=np.float64)}
+    if item_types.any():
+        arrays['item_types'] = item_types
+    return arrays
+
+
+def decode_values(arrays, missing=None):
+    # Flat items back from encode_values, missing text becomes `missing`
+    if 'numbers' in arrays:
+        if 'item_types' not in arrays:
+            return arrays['numbers']
+        values = arrays['numbers'].astype(object)
+        integers = arrays['item_types'] == 1
+        values[integers] = arrays['numbers'][integers].astype(np.int64).astype(object)
+        values[arrays['item_types'] == 2] = None
+        return values
+    values = arrays['uniques'].astype(object).take(np.maximum(arrays['codes'], 0)) if len(arrays['codes']) else \
+        np.zeros(0, dtype=object)
+    values[arrays['codes'] < 0] = missing
+    return values
+
+
+def save_typed_frame(df, output_file_path):
+    # Write a frame with native list columns: each list or tuple column is stored flat with row offsets,
+    # so nothing has to be parsed back from text; other columns keep their dtype (object columns as text codes)
+    arrays = {'typed_version': np.int64(TYPED_VERSION), 'columns': np.asarray(list(map(str, df.columns)), dtype=str)}
+    kinds = []
+    for index, column in enumerate(df.columns):
+        cells = df[column].tolist()
+        if cells and all(isinstance(cell, (list, tuple)) for cell in cells) or (not cells and column in LIST_COLUMNS):
+            kinds.append('tuple' if cells and isinstance(cells[0], tuple) or (not cells and LIST_COLUMNS[column] is tuple)
+                         else 'list')
+            lengths = np.fromiter((len(cell) for cell in cells), dtype=np.int64, count=len(cells))
+            arrays[f'{index}.offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            flat = [item for cell in cells for item in cell]
+        elif df[column].dtype != object:
+            kinds.append('scalar')
+            arrays[f'{index}.array'] = df[column].to_numpy()
+            continue
+        else:
+            kinds.append('scalar')
+            flat = cells
+        for name, array in encode_values(flat).items():
+            arrays[f'{index}.{name}'] = array
+    arrays['kinds'] = np.asarray(kinds, dtype=str)
+
+    temp_file = output_file_path + '.tmp'
+    with open(temp_file, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temp_file, output_file_path)
+
+
+def read_column(data, index):
+    # Flat values (and offsets for list columns) of column number index of a loaded typed file
+    arrays = {name.split('.', 1)[1]: data[name] for name in data.files if name.split('.', 1)[0] == str(index)}
+    # Missing text in a scalar column is NaN, as pd.read_csv gives it
+    if 'array' in arrays:
+        return arrays['array'], None
+    offsets = arrays.get('offsets')
+    return decode_values(arrays, None if offsets is not None else np.nan), offsets
+
+
+def load_typed_frame(path):
+    # A typed file back as a frame, list columns hold tuples or lists again
+    with np.load(path) as data:
+        if int(data['typed_version']) != TYPED_VERSION:
+            raise ValueError(f"{path} has typed layout {int(data['typed_version'])}, expected {TYPED_VERSION}")
+        columns = {}
+        for index, (column, kind) in enumerate(zip(data['columns'].tolist(), data['kinds'].tolist())):
+            values, offsets = read_column(data, index)
+            if offsets is None:
+                columns[column] = values
+            else:
+                items = values.tolist()
+                bounds = offsets.tolist()
+                make = tuple if kind == 'tuple' else list
+                columns[column] = pd.Series([make(items[start:end]) for start, end in zip(bounds[:-1], bounds[1:])],
+                                            dtype=object)
+    return pd.DataFrame(columns)
+
+
+def load_list_column(path, column):
+    # (flat values, row offsets) of one list column of a typed file, without building a tuple per row
+    with np.load(path) as data:
+        index = data['columns'].tolist().index(column)
+        values, offsets = read_column(data, index)
+    if offsets is None:
+        raise ValueError(f"Column {column} of {path} is not a list column")
+    return values, offsets
+
+
+def parse_list_cells(cells):
+    # (flat values, row offsets) of a column of list reprs read from a CSV, missing cells are empty lists
+    lists = [parse_literal_list(cell) for cell in cells]
+    lengths = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+    flat = [item for items in lists for item in items]
+    values = decode_values(encode_values(flat)) if flat else np.zeros(0, dtype=object)
+    return values, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def typed_companion(csv_path):
+    # The typed file written with a CSV, None when there is none or it is older than the CSV
+    path = typed_path(csv_path)
+    if os.path.exists(path) and (not os.path.exists(csv_path) or os.path.getmtime(path) >= os.path.getmtime(csv_path)):
+        return path
+    return None
+
+
+def load_analysis(csv_path):
+    # An analysis output as a frame with tuple/list cells: from its typed companion when there is one,
+    # otherwise from the CSV with the known list columns parsed by parse_literal_list
+    # (floats read round trip, the default parser can be off in the last digit where the typed file is exact)
+    path = typed_companion(csv_path)
+    if path is not None:
+        return load_typed_frame(path)
+    df = pd.read_csv(csv_path, float_precision='round_trip')
+    for column, make in LIST_COLUMNS.items():
+        if column in df.columns and holds_lists(df[column]):
+            df[column] = pd.Series([make(parse_literal_list(cell)) for cell in df[column]], dtype=object)
+    return df
+
+
+def analysis_list_column(csv_path, column, df=None):
+    # (flat values, row offsets) of a list column of an analysis output, from the typed companion when there is one
+    # df: the CSV already read with pd.read_csv, to avoid reading it twice
+    path = typed_companion(csv_path)
+    if path is not None:
+        return load_list_column(path, column)
+    if df is None:
+        df = pd.read_csv(csv_path, usecols=[column])
+    return parse_list_cells(df[column])
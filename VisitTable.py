@@ -0,0 +1,231 @@
+# Imports
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from LocationTaxonomy import compile_taxonomy, group_codes_of
+
+# Long format visit table shared by every stage
+# ids: tracker ids in output row order (trackers with no visits left are kept)
+# visits: one row per visit with the columns in VISIT_COLUMNS, ordered by tracker then visit
+# width: number of location_N slots to write when exporting the wide CSV
+VisitTable = namedtuple('VisitTable', ['ids', 'visits', 'width'])
+
+VISIT_COLUMNS = ['id', 'visit', 'location', 'enter', 'exit', 'duration']
+
+# Enter/exit times are int64 seconds since the epoch, missing times use the datetime64 NaT value
+NAT = np.iinfo(np.int64).min
+
+# Locations dropped before consecutive visits are fused
+INVALID_LOCATIONS = ['Not Sorted', 'Unknown']
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH = datetime(1970, 1, 1)
+
+
+# Functions
+
+def parse_timestamps(values):
+    # 'YYYY-MM-DD HH:MM:SS' strings (or datetimes) to int64 epoch seconds, unparseable values become NAT
+    times = pd.to_datetime(pd.Series(values, dtype=object), format=TIME_FORMAT, errors='coerce')
+    return times.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').view(np.int64)
+
+
+def format_timestamp(seconds):
+    # One int epoch second value to a 'YYYY-MM-DD HH:MM:SS' string
+    return (EPOCH + timedelta(seconds=int(seconds))).strftime(TIME_FORMAT)
+
+
+def format_timestamps(seconds):
+    # int64 epoch seconds to 'YYYY-MM-DD HH:MM:SS' strings, NAT becomes NaN
+    seconds = np.asarray(seconds, dtype=np.int64)
+    text = np.datetime_as_string(seconds.view('datetime64[s]'), unit='s')
+
+    # Swap the ISO 'T' separator for a space directly in the fixed width unicode buffer
+    if len(text) > 0 and text.dtype.itemsize // 4 > 10:
+        text.view(np.uint32).reshape(len(text), -1)[:, 10] = ord(' ')
+
+    result = text.astype(object)
+    result[seconds == NAT] = np.nan
+    return result
+
+
+def empty_visits():
+    return pd.DataFrame({
+        'id': pd.Series(dtype=object),
+        'visit': pd.Series(dtype=np.int64),
+        'location': pd.Series(dtype=object),
+        'enter': pd.Series(dtype=np.int64),
+        'exit': pd.Series(dtype=np.int64),
+        'duration': pd.Series(dtype=np.float64),
+    })
+
+
+def number_visits(visits):
+    # Renumber the per-tracker visit ordinal (1, 2, 3, ...) after rows were dropped or reordered
+    visits = visits.reset_index(drop=True)
+    visits['visit'] = visits.groupby('id', sort=False).cumcount().to_numpy(dtype=np.int64) + 1
+    return visits
+
+
+def make_table(ids, visits, width=None):
+    # Build a table, the export width defaults to the busiest tracker
+    if width is None:
+        width = int(visits['visit'].max()) if len(visits) else 0
+    # Each tracker is one output row, so repeated ids collapse onto the first one
+    return VisitTable(list(dict.fromkeys(ids)), visits[VISIT_COLUMNS], width)
+
+
+def visits_from_events(events):
+    # Events is a frame of paired visits with id, location, enter, exit (epoch seconds) and duration columns
+    if len(events) == 0:
+        return make_table([], empty_visits())
+
+    visits = pd.DataFrame({
+        'id': events['id'].astype(str).to_numpy(dtype=object),
+        'location': events['location'].to_numpy(dtype=object),
+        'enter': events['enter'].to_numpy(dtype=np.int64),
+        'exit': events['exit'].to_numpy(dtype=np.int64),
+        'duration': events['duration'].to_numpy(dtype=np.float64),
+    })
+
+    # Sort by id then enter_time, keeping log order for ties
+    visits = visits.sort_values(by=['id', 'enter'], kind='stable')
+    visits = number_visits(visits)
+    return make_table(pd.unique(visits['id']), visits)
+
+
+def visits_from_entries(log_entries):
+    # Entries are dicts with id, location, enter_time, exit_time (as text) and duration
+    if len(log_entries) == 0:
+        return make_table([], empty_visits())
+
+    df = pd.DataFrame(log_entries)
+    return visits_from_events(pd.DataFrame({
+        'id': df['id'],
+        'location': df['location'],
+        'enter': parse_timestamps(df['enter_time']),
+        'exit': parse_timestamps(df['exit_time']),
+        'duration': df['duration'],
+    }))
+
+
+def read_wide_csv(csv_input):
+    # Load a wide id, location_1, enter_time_1, exit_time_1, duration_1, ... CSV into a visit table
+    df = pd.read_csv(csv_input, dtype={'id': str})
+    ids = df['id'].tolist()
+
+    # Count the slots from the location columns instead of assuming the column layout
+    slots = [int(col[len('location_'):]) for col in df.columns if col.startswith('location_')]
+    width = max(slots) if slots else 0
+    if width == 0:
+        return make_table(ids, empty_visits(), 0)
+
+    location_cols = [f'location_{i}' for i in range(1, width + 1)]
+    enter_cols = [f'enter_time_{i}' for i in range(1, width + 1)]
+    exit_cols = [f'exit_time_{i}' for i in range(1, width + 1)]
+    duration_cols = [f'duration_{i}' for i in range(1, width + 1)]
+
+    # Row-major flattening keeps visits grouped by tracker and in slot order
+    locations = df.reindex(columns=location_cols).to_numpy(dtype=object).ravel()
+    present = pd.notna(locations)
+    row_ids = np.repeat(np.asarray(ids, dtype=object), width)
+
+    def column_values(cols):
+        return df.reindex(columns=cols).to_numpy(dtype=object).ravel()[present]
+
+    durations = pd.to_numeric(pd.Series(column_values(duration_cols)), errors='coerce')
+    visits = pd.DataFrame({
+        'id': row_ids[present],
+        'location': locations[present].astype(str),
+        'enter': parse_timestamps(column_values(enter_cols)),
+        'exit': parse_timestamps(column_values(exit_cols)),
+        'duration': durations.to_numpy(dtype=np.float64),
+    })
+    visits['location'] = visits['location'].astype(object)
+    return make_table(ids, number_visits(visits), width)
+
+
+def load_table(source):
+    # Stages take either a visit table handed over in memory or the path of a wide CSV
+    if isinstance(source, VisitTable):
+        return source
+    return read_wide_csv(source)
+
+
+def fuse_visits(table, invalid_locations=INVALID_LOCATIONS):
+    # Drop invalid locations, then reduce each run of identical consecutive locations of a tracker
+    # to one visit with the first enter time, the latest exit time and the summed duration
+    visits = table.visits
+    visits = visits[~visits['location'].isin(invalid_locations)]
+    if len(visits) == 0:
+        return make_table(table.ids, empty_visits(), table.width)
+
+    id_codes = pd.factorize(visits['id'])[0]
+    location_codes = pd.factorize(visits['location'])[0]
+
+    # A run starts at each tracker's first visit and wherever the location changes
+    run_start = np.ones(len(visits), dtype=bool)
+    run_start[1:] = (id_codes[1:] != id_codes[:-1]) | (location_codes[1:] != location_codes[:-1])
+    starts = np.flatnonzero(run_start)
+
+    # Missing durations count as 0 and runs that sum to 0 are written as blank
+    durations = np.nan_to_num(visits['duration'].to_numpy(dtype=np.float64), nan=0.0)
+    durations = np.add.reduceat(durations, starts)
+
+    fused_visits = pd.DataFrame({
+        'id': visits['id'].to_numpy()[starts],
+        'location': visits['location'].to_numpy()[starts],
+        'enter': visits['enter'].to_numpy(dtype=np.int64)[starts],
+        'exit': np.maximum.reduceat(visits['exit'].to_numpy(dtype=np.int64), starts),
+        'duration': np.where(durations == 0, np.nan, durations),
+    })
+
+    # Same number of location columns as the input on export
+    return make_table(table.ids, number_visits(fused_visits), table.width)
+
+
+def partition_visits(table, location_filters):
+    # Map every visit to its group once and split the table into one table per group
+    taxonomy = compile_taxonomy(location_filters)
+
+    # Visits whose location is in no group (code -1) are left out
+    visit_groups = group_codes_of(table.visits['location'], taxonomy)
+    group_visits = dict(tuple(table.visits[visit_groups >= 0].groupby(visit_groups[visit_groups >= 0], sort=True)))
+
+    partitions = {}
+    for group_code, group in enumerate(taxonomy.groups):
+        if group_code in group_visits:
+            visits = number_visits(group_visits[group_code])
+            partitions[group] = make_table(pd.unique(visits['id']), visits)
+    return partitions
+
+
+def visits_to_wide(table):
+    # Wide layout for export: one row per tracker, location_i, enter_time_i, exit_time_i, duration_i interleaved
+    visits = table.visits
+    width = table.width
+
+    # Each visit lands at (row of its tracker, visit ordinal - 1), so one scatter fills every slot
+    rows = pd.Index(table.ids).get_indexer(visits['id'])
+    slots = visits['visit'].to_numpy(dtype=np.int64) - 1
+
+    values = np.full((len(table.ids), width, 4), np.nan, dtype=object)
+    values[rows, slots, 0] = visits['location'].to_numpy(dtype=object)
+    values[rows, slots, 1] = format_timestamps(visits['enter'].to_numpy())
+    values[rows, slots, 2] = format_timestamps(visits['exit'].to_numpy())
+    values[rows, slots, 3] = visits['duration'].to_numpy(dtype=np.float64)
+
+    columns = []
+    for i in range(1, width + 1):
+        columns += [f'location_{i}', f'enter_time_{i}', f'exit_time_{i}', f'duration_{i}']
+
+    # Flatten the slot and field axes into the interleaved column order
+    result_df = pd.DataFrame(values.reshape(len(table.ids), width * 4), columns=columns)
+    result_df.insert(0, 'id', table.ids)
+    return result_df
+
+
+def write_wide_csv(table, output_file_path):
+    visits_to_wide(table).to_csv(output_file_path, index=False)